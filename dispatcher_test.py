@@ -0,0 +1,107 @@
+import asyncio
+
+from lib.tunnel.util import *
+from lib.tunnel.protocol import TunnelProtocol
+from lib.tunnel.dispatcher import CallbackDispatcher
+
+
+class SlowReceiver:
+    """Counts results of a category. Callbacks take delay seconds to finish"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.values = []
+
+    async def callback(self, result):
+        value = result.get_int()
+        await asyncio.sleep(self.delay)
+        self.values.append(value)
+
+
+async def flood(num_packets, max_in_flight, max_queued):
+    protocol = TunnelProtocol()
+    dispatcher = CallbackDispatcher(
+        concurrent=True, max_in_flight=max_in_flight, max_queued=max_queued, error_stats=protocol.error_stats
+    )
+    slow = SlowReceiver(0.05)
+    fast = SlowReceiver(0.0)
+    dispatcher.set_callbacks("slow", [slow.callback])
+    dispatcher.set_callbacks("fast", [fast.callback])
+
+    buffer = b""
+    for count in range(num_packets):
+        buffer += protocol.make_packet("slow", "d", count)
+    for count in range(10):
+        buffer += protocol.make_packet("fast", "d", count)
+    remaining_buffer, buffer, results = protocol.parse_buffer(buffer)
+    assert len(results) == num_packets + 10, len(results)
+
+    max_queue_len = 0
+    for result in results:
+        await dispatcher.dispatch(result)
+        max_queue_len = max(max_queue_len, len(dispatcher.queued.get("slow", ())))
+    print("Longest queue: %s, dropped: %s" % (max_queue_len, dispatcher.num_dropped))
+    assert max_queue_len <= max_queued, max_queue_len
+
+    num_dropped = num_packets - max_in_flight - max_queued
+    assert dispatcher.num_dropped == num_dropped, dispatcher.num_dropped
+    assert protocol.error_stats.counts.get(CALLBACK_QUEUE_FULL_ERROR) == num_dropped, protocol.error_stats.counts
+
+    while dispatcher.get_num_pending() > 0:
+        await asyncio.sleep(0.01)
+
+    # the first results to arrive run immediately and the newest are kept in the queue
+    expected = list(range(max_in_flight)) + list(range(num_packets - max_queued, num_packets))
+    assert sorted(slow.values) == expected, slow.values
+    # the flood in one category doesn't drop results of another
+    assert sorted(fast.values) == list(range(10)), fast.values
+    print(protocol.error_stats.get_summary())
+
+
+class CancellingReceiver:
+    """Records the order results run in. The first callback ends in CancelledError on its own"""
+
+    def __init__(self):
+        self.values = []
+
+    async def callback(self, result):
+        value = result.get_int()
+        self.values.append(value)
+        await asyncio.sleep(0.01)
+        if value == 0:
+            # like an inner wait_for that was cancelled. The dispatcher itself wasn't cancelled
+            raise asyncio.CancelledError
+
+
+async def cancelled_callbacks(num_packets):
+    protocol = TunnelProtocol()
+    dispatcher = CallbackDispatcher(concurrent=True, max_in_flight=1)
+    receiver = CancellingReceiver()
+    dispatcher.set_callbacks("cancel", [receiver.callback])
+
+    buffer = b""
+    for count in range(num_packets):
+        buffer += protocol.make_packet("cancel", "d", count)
+    remaining_buffer, buffer, results = protocol.parse_buffer(buffer)
+    for result in results[:num_packets // 2]:
+        await dispatcher.dispatch(result)
+
+    # let the cancelled callback finish. Results arriving after it must run after the queued ones
+    await asyncio.sleep(0.05)
+    for result in results[num_packets // 2:]:
+        await dispatcher.dispatch(result)
+
+    while dispatcher.get_num_pending() > 0:
+        await asyncio.sleep(0.01)
+    print("Run order after a cancelled callback:", receiver.values)
+    assert receiver.values == list(range(num_packets)), receiver.values
+
+
+def main():
+    asyncio.run(flood(1000, 2, 8))
+    asyncio.run(cancelled_callbacks(10))
+    print("Passed")
+
+
+if __name__ == "__main__":
+    main()
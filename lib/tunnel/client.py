@@ -1,13 +1,20 @@
+import time
 import asyncio
 import warnings
 import threading
+from collections import deque
 
 from lib.tunnel.util import *
 
 from .result import PacketResult
 from .result import FuturePacketResult
 from .handshake import Handshake
+from .handshake import HandshakeTable
+from .handshake import RetransmitTimer
 from .protocol import TunnelProtocol
+from .template import PacketTemplate
+from .decoder import TunnelDecoder
+from .dispatcher import CallbackDispatcher
 
 
 class TunnelBaseClient:
@@ -26,6 +33,8 @@ class TunnelBaseClient:
         Pass a function reference. When a matching category is received, all registered callbacks will receive the data
     write(category, *args):
         Write data to device as a TunnelProtocol packet
+    write_many(messages):
+        Write many TunnelProtocol packets to the device at once
     write_handshake(category, *args, write_interval=0.0, timeout=1.0):
         Write data to device as a TunnelProtocol packet. Raise an exception in the call to update()
         if a confirming packet isn't received within the specified timeout
@@ -39,20 +48,53 @@ class TunnelBaseClient:
         self.debug = debug
         self.protocol = TunnelProtocol(max_packet_len, debug)  # defines the tunnel protocol and parse packet behavior
 
-        self.buffer = b''  # stores unparsed characters for the next round
+        self.decoder = TunnelDecoder(self.protocol)  # stores unparsed characters and parse state for the next round
 
-        # when write_handshake is called, an object is stored here that keeps track of its status
-        self.pending_handshakes = []
+        self.write_buffer = bytearray()  # packets created by write_many are placed here before writing
 
-        # when get is called, an object is stored here that keeps track of its status
-        self.pending_gets = []
+        # when write_handshake is called, an object is stored here that keeps track of its status.
+        # Handshakes are keyed by category and packet number and removed once they're confirmed or expire
+        self.pending_handshakes = HandshakeTable()
+
+        # estimates the time to wait before writing a handshake again from confirm round trip times
+        self.retransmit_timer = RetransmitTimer()
+
+        # If True, handshakes with a write_interval are written again after a timeout estimated by retransmit_timer
+        # that doubles with each attempt instead of after a fixed write_interval
+        self.adaptive_retransmit = False
+
+        # maximum number of unconfirmed handshakes. Handshakes written beyond this are queued and written once
+        # pending handshakes are confirmed or expire. If less than or equal to 0, there's no limit
+        self.max_handshakes_in_flight = 0
+        self.queued_handshakes = deque()  # (category, formats, args, write_interval, timeout) of queued handshakes
+
+        # maximum number of queued handshakes. If the device stops confirming, the oldest queued handshake is
+        # dropped with a warning to make room. If less than or equal to 0, there's no limit
+        self.max_queued_handshakes = 64
+
+        # when get is called, an object is stored here that keeps track of its status.
+        # format is {"category": deque([future_result1, future_result2, ...])}. Requests are resolved in order
+        self.pending_gets = {}
 
         # dictionary that stores callback functions for various categories.
         # format is {"category1": [callback1, callback2, ...], "category2": [callbackA, callbackB, ...], ...}
         self.callbacks = {}
 
+        # runs the callbacks in self.callbacks. Set dispatcher.concurrent to True to run coroutine callbacks
+        # as tasks with at most dispatcher.max_in_flight running per category. Results dropped because a
+        # category has dispatcher.max_queued results waiting are counted in protocol.error_stats
+        self.dispatcher = CallbackDispatcher(error_stats=self.protocol.error_stats)
+
         self.throw_error_on_failed_handshake = False
 
+        # If True, warn when a callback parsed some but not all of a result's data segments
+        self.check_unparsed_data = False
+
+        # If True, handshake packets received from the device are confirmed.
+        # Confirms for all handshakes received in one call to update are written at once
+        self.confirm_handshakes = True
+        self.pending_confirms = []  # (category, formats, args) of confirming packets to write at the end of update
+
     def start(self):
         """Initializes the device"""
         raise NotImplementedError
@@ -68,10 +110,15 @@ class TunnelBaseClient:
         """
         Call this in a loop to read all buffered data and run callbacks.
         Throws HandshakeFailedException if a handshake expires
-        :return: List[PacketResult] all packet results received this round (empty if no packets received)
+        :return: List[PacketResult] all packet results received this round (empty if no packets received).
+            If self.protocol.zero_copy is True, their data segments can only be read while callbacks run.
+            If self.protocol.result_pool is set, they're reused on the next call
         """
         self.check_handshakes()  # check pending handshakes. Throw an exception if any expired
 
+        # warn errors held back by the summary rate limit even if the link has gone quiet
+        self.protocol.error_stats.warn_summary()
+
         num_bytes = self.available()
 
         # if the device hasn't sent anything, don't do any parsing
@@ -81,11 +128,10 @@ class TunnelBaseClient:
 
         # read all characters available on the buffer
         recv_msg = self._read(num_bytes)
-        self.buffer += recv_msg  # append characters to buffer. The buffer may have characters from last call
 
-        # parse all characters on the buffer. Return any characters that weren't parsed into a packet
-        # as well as any characters that might be worth notifying the user about
-        remaining_buffer, self.buffer, results = self.protocol.parse_buffer(self.buffer)
+        # feed the new characters to the decoder. Characters of partial packets are kept for the next call.
+        # Return any complete packets as well as any characters that might be worth notifying the user about
+        remaining_buffer, results = self.decoder.feed(recv_msg)
         self.parse_debug_buffer(remaining_buffer)  # Print any debug messages received
 
         # no packets received. don't do any parsing
@@ -97,10 +143,18 @@ class TunnelBaseClient:
         # put the result of that method into received
         received = []
         for result in results:
-            result = await self.handle_result(result)
-            if result is None:
+            handled = await self.handle_result(result)
+            if self.check_unparsed_data:
+                result.check_unparsed()
+            if handled is None:
                 continue
-            received.append(result)
+            received.append(handled)
+        self.write_confirms()
+
+        # if the protocol is in zero copy mode, results reference the decoder's buffer. Release them so the
+        # buffer can be reused. If the protocol has a result pool, results are returned to it.
+        # Callbacks that keep a result past this point must call PacketResult.keep
+        self.decoder.release_results()
         return received
 
     def register_callback(self, category: str, callback):
@@ -113,6 +167,7 @@ class TunnelBaseClient:
         if category not in self.callbacks:
             self.callbacks[category] = []
         self.callbacks[category].append(callback)
+        self.dispatcher.set_callbacks(category, self.callbacks[category])
         print("Registering callback for '%s' category. Num callbacks: %s" % (category, len(self.callbacks[category])))
 
     async def handle_result(self, result: PacketResult):
@@ -141,13 +196,25 @@ class TunnelBaseClient:
                 return None
 
             # check if parsed Handshake object matches any pending handshakes
-            if handshake in self.pending_handshakes:
-                self.pending_handshakes.remove(handshake)
+            pending_handshake = self.pending_handshakes.pop(handshake.category, handshake.packet_num)
+            if pending_handshake is not None:
+                # only handshakes written once have a known round trip time
+                if pending_handshake.attempt_counter == 0:
+                    self.retransmit_timer.add_sample(time.time() - pending_handshake.initial_write_time)
+                self.write_queued_handshakes()
                 return handshake
             warnings.warn("Received confirm handshake, but no handshakes are expecting it! %s. Pending: %s" % (
                 handshake, str(self.pending_handshakes)))
 
-        future_result = self.find_matching_future_result(result)
+        # confirm handshakes from the device so it stops writing them again. The packet is still sent to callbacks
+        if self.confirm_handshakes and result.packet_type == PACKET_TYPE_HANDSHAKE:
+            self.pending_confirms.append(
+                (result.category, CONFIRMING_FORMATS, (result.packet_num, result.error_code)))
+
+        if result.packet_type == PACKET_TYPE_CONFIRMING:
+            future_result = None  # confirms don't answer get requests
+        else:
+            future_result = self.find_matching_future_result(result)
         if future_result is not None:
             # if this result matches a future, copy the data so it can be used externally
             if self.debug:
@@ -159,29 +226,78 @@ class TunnelBaseClient:
         await self.packet_callback(result)
 
         # run through registered callback functions if any match
-        if result.category in self.callbacks:
-            for callback in self.callbacks[result.category]:
-                await callback(result)
+        await self.dispatcher.dispatch(result)
         return result
     
     def find_matching_future_result(self, result: PacketResult):
-        for future_result in self.pending_gets:
-            if future_result.category == result.category:
-                return future_result
-        return None
+        """
+        Remove and return the oldest get request waiting for this result's category
+        :return: FuturePacketResult or None if no requests are waiting
+        """
+        queue = self.pending_gets.get(result.category)
+        if queue is None:
+            return None
+        future_result = queue.popleft()
+        if len(queue) == 0:
+            del self.pending_gets[result.category]
+        return future_result
+
+    def remove_future_result(self, future_result: FuturePacketResult):
+        """Stop waiting for a get request that timed out or was cancelled"""
+        if future_result.event.is_set():
+            return  # already resolved. find_matching_future_result removed it from the queue
+        queue = self.pending_gets.get(future_result.category)
+        if queue is None:
+            return
+        # compare by identity. PacketResults with the same category and packet number are equal
+        for index, queued_result in enumerate(queue):
+            if queued_result is future_result:
+                del queue[index]
+                break
+        else:
+            return  # already resolved
+        if len(queue) == 0:
+            del self.pending_gets[future_result.category]
 
     def check_handshakes(self):
-        """Check if any handshakes expired or if any packets are due to be written again"""
-        for handshake in self.pending_handshakes:
-            if handshake.should_write_again():
-                print("Writing handshake again %s" % handshake)
-                self._write(handshake.packet)
-            if handshake.did_fail():
-                exception = HandshakeFailedException("%s failed" % str(handshake))
-                if self.throw_error_on_failed_handshake:
-                    raise exception
-                else:
-                    warnings.warn(exception)
+        """
+        Check if any handshakes expired or if any packets are due to be written again.
+        Expired handshakes are no longer pending
+        """
+        to_write, expired = self.pending_handshakes.pop_due(retransmit_timer=self.get_active_retransmit_timer())
+        for handshake in to_write:
+            print("Writing handshake again %s" % handshake)
+            self._write(handshake.packet)
+        for handshake in expired:
+            exception = HandshakeFailedException("%s failed" % str(handshake))
+            if self.throw_error_on_failed_handshake:
+                raise exception
+            else:
+                warnings.warn(exception)
+        if len(expired) > 0:
+            self.write_queued_handshakes()
+
+    def get_next_deadline(self):
+        """
+        Time (in time.time() seconds) update should be called again even if no data arrives.
+        :return: float or None if update doesn't need to be called until data arrives
+        """
+        return self.pending_handshakes.get_next_deadline()
+
+    def get_active_retransmit_timer(self):
+        """Return retransmit_timer if adaptive_retransmit is enabled, otherwise None"""
+        if self.adaptive_retransmit:
+            return self.retransmit_timer
+        else:
+            return None
+
+    def write_queued_handshakes(self):
+        """Write queued handshakes in the order they were queued until max_handshakes_in_flight is reached"""
+        while len(self.queued_handshakes) > 0:
+            if 0 < self.max_handshakes_in_flight <= len(self.pending_handshakes):
+                break
+            category, formats, args, write_interval, timeout = self.queued_handshakes.popleft()
+            self.send_handshake(category, formats, args, write_interval, timeout)
 
     def parse_debug_buffer(self, remaining_buffer):
         """Print debug messages in the buffer delimited by the \n character"""
@@ -204,14 +320,21 @@ class TunnelBaseClient:
     async def get(self, category: str, formats: str, *args, timeout=None):
         """
         Write a packet and return the values of the next return packet with the same category.
+        Many requests for the same category can be outstanding. They're answered in the order they were made.
         Raises asyncio.TimeoutError if timeout is reached.
         If timeout is None, this method will block indefinitely until a packet is found.
         """
-        self.write_handshake(category, formats, *args)
         future_result = FuturePacketResult(category)
-        self.pending_gets.append(future_result)
-        await future_result.wait(timeout)
-        self.pending_gets.remove(future_result)
+        if category not in self.pending_gets:
+            self.pending_gets[category] = deque()
+        self.pending_gets[category].append(future_result)
+        try:
+            self.write_handshake(category, formats, *args)
+            await future_result.wait(timeout)
+        finally:
+            # on timeout or cancellation, the request must not be answered by a later packet.
+            # Answered requests return without searching the queue
+            self.remove_future_result(future_result)
         return future_result
 
     def write(self, category: str, formats: str, *args):
@@ -226,15 +349,61 @@ class TunnelBaseClient:
         """
         self._write(self.protocol.make_packet(category, formats, *args))
 
+    def write_template(self, template: PacketTemplate):
+        """
+        Write a packet encoded ahead of time with TunnelProtocol.make_packet_template.
+        Used to write the same packet to many devices
+        :param template: packet to write
+        :return: None
+        """
+        self._write(self.protocol.make_packet_from_template(template))
+
+    def write_many(self, messages, packet_type=PACKET_TYPE_NORMAL):
+        """
+        Write many TunnelProtocol packets to the device in a single call to _write
+
+        :param messages: iterable of (category, formats, args) where args is a tuple of objects to interpret
+            into a packet. Refer to write
+        :param packet_type: util.PACKET_TYPE_NORMAL or util.PACKET_TYPE_CONFIRMING
+        :return: None
+        """
+        self.write_buffer.clear()
+        if self.protocol.make_packets_into(self.write_buffer, messages, packet_type) > 0:
+            self._write(self.write_buffer)
+
+    def write_confirms(self):
+        """Write confirming packets for handshakes received during this update in a single call to _write"""
+        if len(self.pending_confirms) == 0:
+            return
+        confirms = self.pending_confirms
+        self.pending_confirms = []
+        self.write_many(confirms, PACKET_TYPE_CONFIRMING)
+
     def write_handshake(self, category: str, formats: str, *args, write_interval=0.0, timeout=1.0):
+        """
+        Write data to device as a TunnelProtocol handshake packet. If max_handshakes_in_flight handshakes
+        are unconfirmed, the handshake is queued and written later. Its timeout starts when it's written.
+        If max_queued_handshakes handshakes are queued, the oldest is dropped
+        """
         if write_interval > timeout:
             warnings.warn(
                 "write_interval (%0.4f) is greater than timeout (%0.4f). Packet will not be rewritten" % (
                     write_interval, timeout)
             )
+        if self.max_handshakes_in_flight > 0 and (
+                len(self.queued_handshakes) > 0 or len(self.pending_handshakes) >= self.max_handshakes_in_flight):
+            if 0 < self.max_queued_handshakes <= len(self.queued_handshakes):
+                dropped = self.queued_handshakes.popleft()
+                warnings.warn("Handshake queue is full. Dropping '%s' handshake: %s" % (dropped[0], dropped[2]))
+            self.queued_handshakes.append((category, formats, args, write_interval, timeout))
+            return
+        self.send_handshake(category, formats, args, write_interval, timeout)
+
+    def send_handshake(self, category: str, formats: str, args: tuple, write_interval: float, timeout: float):
+        """Create a handshake packet, start tracking it, and write it to the device"""
         handshake = self.protocol.make_handshake_packet(category, formats, *args, write_interval=write_interval, timeout=timeout)
         packet = handshake.packet
-        self.pending_handshakes.append(handshake)
+        self.pending_handshakes.add(handshake, self.get_active_retransmit_timer())
         self._write(packet)
 
     def _read(self, num_bytes):
@@ -0,0 +1,247 @@
+import sys
+import struct
+import functools
+from .util import *
+
+# struct codes for each TunnelProtocol format key. Integers are big endian, floats use the host's byte order
+INT_CODES = {
+    "l": "q",
+    "m": "Q",
+    "d": "i",
+    "u": "I",
+    "b": "b",
+    "c": "B",
+    "h": "h",
+    "g": "H",
+}
+FLOAT_CODES = {
+    "f": "f",
+    "e": "d",
+}
+STRING_KEY = "s"
+STRING_CODE = "H%ds"  # two length bytes followed by the string's bytes
+MAX_STRING_STRUCTS = 256  # number of compiled structs kept per codec for formats containing strings
+
+INT_BYTE_ORDER = ">"
+FLOAT_BYTE_ORDER = "<" if sys.byteorder == "little" else ">"
+
+# argument types accepted for each kind of format key
+INT_TYPES = (int, bool)
+FLOAT_TYPES = (float,)
+STRING_TYPES = (str, bytes)
+
+
+class FormatCodec:
+    """
+    A TunnelProtocol format string (ex. "uuu", "e", "s") compiled into struct objects.
+    Packs all arguments of a packet's data segment in a single struct.pack call and
+    unpacks formats without strings in a single struct.unpack_from call.
+
+    Consecutive keys that share a byte order are packed together. Since the formats used by this project
+    don't mix integers and floats, they compile to a single struct.
+    """
+
+    def __init__(self, formats: str, use_double_precision=True):
+        """
+        :param formats: str, format keys. Refer to TunnelProtocol.make_packet for keys.
+        :param use_double_precision: If False, "e" keys are packed as 4 byte floats
+        """
+        self.formats = formats
+        self.use_double_precision = use_double_precision
+
+        # False if formats contains a key this codec doesn't know how to pack
+        self.is_valid = all(key in INT_CODES or key in FLOAT_CODES or key == STRING_KEY for key in formats)
+        self.has_strings = STRING_KEY in formats
+
+        # the argument types expected most of the time. Checked with a single tuple comparison
+        if self.is_valid:
+            self.arg_types = tuple(self.get_valid_types(key)[0] for key in formats)
+        else:
+            self.arg_types = None
+
+        # list of (byte_order, struct codes, value start, value stop, length start, length stop) for each run
+        # of keys with the same byte order. Strings expand into two values: the length and the bytes
+        self.runs = []
+        value_index = 0
+        length_index = 0
+        for key in formats:
+            if key in FLOAT_CODES:
+                byte_order = FLOAT_BYTE_ORDER
+                if key == "e" and not self.use_double_precision:
+                    code = FLOAT_CODES["f"]
+                else:
+                    code = FLOAT_CODES[key]
+            elif key == STRING_KEY:
+                byte_order = INT_BYTE_ORDER
+                code = STRING_CODE
+            else:
+                byte_order = INT_BYTE_ORDER
+                code = INT_CODES.get(key, "")
+            num_values = 2 if key == STRING_KEY else 1
+            num_lengths = 1 if key == STRING_KEY else 0
+
+            if len(self.runs) == 0 or self.runs[-1][0] != byte_order:
+                self.runs.append([byte_order, "", value_index, value_index, length_index, length_index])
+            run = self.runs[-1]
+            run[1] += code
+            value_index += num_values
+            length_index += num_lengths
+            run[3] = value_index
+            run[5] = length_index
+
+        # formats without strings have a fixed size and are compiled ahead of time.
+        # Formats with strings are filled in with the string lengths when packing
+        self.structs = None
+        self.struct = None
+        self.template = None
+        self.string_structs = {}  # compiled structs for string lengths seen so far
+        if self.has_strings:
+            if len(self.runs) == 1:
+                self.template = self.runs[0][0] + self.runs[0][1]
+        else:
+            self.structs = [struct.Struct(run[0] + run[1]) for run in self.runs]
+            if len(self.structs) == 1:
+                self.struct = self.structs[0]
+
+        # number of bytes in the data segment. None if the formats contain strings
+        if self.structs is None:
+            self.size = None
+            self.placeholder = None
+        else:
+            self.size = sum([packer.size for packer in self.structs])
+            self.placeholder = bytes(self.size)  # extends buffers by the segment's size before pack_into
+
+    @staticmethod
+    def get_valid_types(key: str) -> tuple:
+        """Argument types that can be packed for a format key"""
+        if key in INT_CODES:
+            return INT_TYPES
+        elif key in FLOAT_CODES:
+            return FLOAT_TYPES
+        elif key == STRING_KEY:
+            return STRING_TYPES
+        else:
+            return ()
+
+    def accepts(self, args: tuple) -> bool:
+        """Check if every argument has a type this codec packs the same way TunnelProtocol.pack_arguments does"""
+        if not self.is_valid:
+            return False
+        for key, arg in zip(self.formats, args):
+            if type(arg) not in self.get_valid_types(key):
+                return False
+        return True
+
+    def pack(self, args: tuple, max_segment_len=0xffff):
+        """
+        Pack arguments into the data segment of a packet
+        :param args: objects to interpret into a packet. Must have the same length as formats
+        :param max_segment_len: strings must be shorter than this
+        :return: bytes or None if the arguments can't be packed by this codec
+        """
+        if tuple(map(type, args)) != self.arg_types and not self.accepts(args):
+            return None
+        try:
+            if self.struct is not None:
+                return self.struct.pack(*args)
+            if self.has_strings:
+                values, lengths = self.expand_strings(args, max_segment_len)
+                if self.template is not None:
+                    packer = self.string_structs.get(lengths)
+                    if packer is None:
+                        if len(self.string_structs) >= MAX_STRING_STRUCTS:
+                            self.string_structs.clear()
+                        packer = struct.Struct(self.template % lengths)
+                        self.string_structs[lengths] = packer
+                    return packer.pack(*values)
+                return b"".join([
+                    struct.pack(run[0] + run[1] % lengths[run[4]:run[5]], *values[run[2]:run[3]])
+                    for run in self.runs
+                ])
+            return b"".join([
+                packer.pack(*args[run[2]:run[3]]) for packer, run in zip(self.structs, self.runs)
+            ])
+        except (struct.error, OverflowError):
+            # out of range values. Let the caller's fallback pack them or raise the appropriate error
+            return None
+
+    def pack_into(self, buffer: bytearray, args: tuple, max_segment_len=0xffff) -> bool:
+        """
+        Pack arguments into the data segment of a packet and append it to buffer. Formats without strings
+        are packed directly into the buffer
+        :param buffer: bytearray to append the data segment to
+        :param args: objects to interpret into a packet. Must have the same length as formats
+        :param max_segment_len: strings must be shorter than this
+        :return: False if the arguments can't be packed by this codec. The buffer isn't changed
+        """
+        if self.structs is None:
+            payload = self.pack(args, max_segment_len)
+            if payload is None:
+                return False
+            buffer += payload
+            return True
+        if tuple(map(type, args)) != self.arg_types and not self.accepts(args):
+            return False
+        offset = len(buffer)
+        buffer += self.placeholder
+        try:
+            if self.struct is not None:
+                self.struct.pack_into(buffer, offset, *args)
+            else:
+                for packer, run in zip(self.structs, self.runs):
+                    packer.pack_into(buffer, offset, *args[run[2]:run[3]])
+                    offset += packer.size
+        except (struct.error, OverflowError):
+            del buffer[len(buffer) - self.size:]
+            return False
+        return True
+
+    def unpack_from(self, buffer, offset=0) -> tuple:
+        """
+        Unpack all values of a data segment. Only formats without strings can be unpacked
+        :param buffer: bytes-like object containing the data segment
+        :param offset: where in the buffer the data segment starts
+        :return: tuple of values, one for each format key
+        """
+        if self.struct is not None:
+            return self.struct.unpack_from(buffer, offset)
+        if self.structs is None:
+            raise TunnelProtocolException("Formats containing strings can't be unpacked: %s" % repr(self.formats))
+        values = ()
+        for packer in self.structs:
+            values += packer.unpack_from(buffer, offset)
+            offset += packer.size
+        return values
+
+    def expand_strings(self, args: tuple, max_segment_len: int) -> tuple:
+        """
+        Replace each string argument with its length and its bytes
+        :return: Tuple[list, tuple] values to pack, byte length of each string
+        """
+        values = []
+        lengths = []
+        for key, arg in zip(self.formats, args):
+            if key != STRING_KEY:
+                values.append(arg)
+                continue
+            # the length segment counts characters the same way TunnelProtocol.pack_arguments does
+            length = len(arg)
+            if length >= max_segment_len:
+                raise TunnelProtocolException("Segment exceeds maximum segment length: %s" % repr(arg))
+            if type(arg) == str:
+                arg = arg.encode()
+            values.append(length)
+            values.append(arg)
+            lengths.append(len(arg))
+        return values, tuple(lengths)
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__name__}('{self.formats}', {self.use_double_precision})"
+
+    __repr__ = __str__
+
+
+@functools.lru_cache(maxsize=None)
+def get_format_codec(formats: str, use_double_precision=True) -> FormatCodec:
+    """Return the cached FormatCodec for a format string. Each format string is only compiled once"""
+    return FormatCodec(formats, use_double_precision)
@@ -0,0 +1,183 @@
+from .util import *
+from .protocol import TunnelProtocol
+
+
+class TunnelDecoder:
+    """
+    Incremental TunnelProtocol decoder. Bytes are fed in as they arrive from the device and packets are
+    returned as soon as their stop byte is received.
+
+    Unlike TunnelProtocol.parse_buffer, the parse state (for example "waiting for N more bytes of packet body")
+    is remembered between calls, so a packet that arrives in pieces is never rescanned from its start.
+    Consumed bytes are removed from the front of the internal bytearray in place.
+
+    If protocol.zero_copy is True, results reference the decoder's buffer through memoryviews. If protocol.result_pool
+    is set, results are reused. In either case they stay valid until the next call to feed or release_results.
+    Call PacketResult.keep to use a result after that.
+
+    Usage:
+    decoder = TunnelDecoder(protocol)
+    debug_bytes, results = decoder.feed(recv_msg)
+    """
+
+    # parse states
+    SEARCHING = 0  # looking for util.PACKET_START_0
+    START_1 = 1  # found util.PACKET_START_0, waiting for util.PACKET_START_1
+    LENGTH = 2  # found both start bytes, waiting for the two length bytes
+    BODY = 3  # length is known, waiting for the rest of the packet up to and including util.PACKET_STOP
+
+    def __init__(self, protocol: TunnelProtocol, max_debug_len=1024):
+        """
+        :param protocol: TunnelProtocol used to parse packets once they're complete
+        :param max_debug_len: maximum number of debug message bytes held while waiting for a newline character
+        """
+        self.protocol = protocol
+        self.max_debug_len = max_debug_len
+
+        self.buffer = bytearray()  # stores bytes of a partially received packet
+        self.debug_buffer = bytearray()  # stores bytes of a partially received debug message
+
+        self.state = self.SEARCHING
+        self.index = 0  # index of the next byte in self.buffer to inspect
+        self.packet_start = 0  # index of util.PACKET_START_0 of the packet currently being received
+        self.packet_stop = 0  # index where util.PACKET_STOP of the packet currently being received should be
+
+        # results referencing self.buffer when the protocol is in zero copy mode or that
+        # should be returned to the protocol's result pool
+        self.issued_results = []
+
+    def feed(self, data: bytes) -> tuple:
+        """
+        Append newly received bytes and parse as many packets as possible
+        :param data: bytes received from the device
+        :return: Tuple[bytes, List[PacketResult]]
+            complete debug messages (delimited by \\n) received so far,
+            list of PacketResult's (empty if no packets were completed)
+        """
+        # results of the previous call can't reference the buffer while it's being modified
+        self.release_results()
+        self.compact()
+
+        try:
+            self.buffer += data
+        except BufferError:
+            # something is still holding a view of the buffer. Leave it with the old buffer
+            self.buffer = self.buffer + data
+        buffer = self.buffer
+        buffer_len = len(buffer)
+        start_1 = PACKET_START_1[0]
+        stop_byte = PACKET_STOP[0]
+
+        index = self.index
+        results = []
+        while True:
+            if self.state == self.SEARCHING:
+                packet_start = buffer.find(PACKET_START_0, index)
+                if packet_start == -1:
+                    # assume data that doesn't start with util.PACKET_START_0 is part of a debug message
+                    self.debug_buffer += buffer[index:buffer_len]
+                    index = buffer_len
+                    break
+                if packet_start > index:
+                    self.debug_buffer += buffer[index:packet_start]
+                self.packet_start = packet_start
+                index = packet_start + PACKET_START_LENGTH
+                self.state = self.START_1
+
+            if self.state == self.START_1:
+                if index >= buffer_len:
+                    break
+                if buffer[index] != start_1:
+                    # assume data that doesn't start with util.PACKET_START_1 is part of a debug message
+                    self.debug_buffer += buffer[index:index + 1]
+                    index += 1
+                    self.state = self.SEARCHING
+                    continue
+                index += PACKET_START_LENGTH
+                self.state = self.LENGTH
+
+            if self.state == self.LENGTH:
+                if index + PACKET_LEN_LENGTH > buffer_len:
+                    break
+                length = (buffer[index] << 8) | buffer[index + 1]  # interpret two length bytes as an integer
+                index += PACKET_LEN_LENGTH
+                self.packet_stop = index + length
+                self.state = self.BODY
+
+            # self.state == self.BODY. Body bytes aren't inspected until the whole packet has arrived
+            if self.packet_stop >= buffer_len:
+                break
+            self.state = self.SEARCHING
+            if buffer[self.packet_stop] != stop_byte:
+                # packet doesn't end with util.PACKET_STOP, it must be corrupted. Search for a new packet
+                # after the first byte following the length bytes
+                index = self.packet_start + PACKET_HEADER_LENGTH + 1
+                continue
+            index = self.packet_stop + 1
+            results.append(self.protocol.parse_found_packet(buffer, self.packet_start, index))
+
+        self.index = index
+        if self.protocol.zero_copy or self.protocol.result_pool is not None:
+            # compact the buffer and reuse these results once they have been released
+            self.issued_results = results
+        else:
+            self.compact()
+        return self.pop_debug_messages(), results
+
+    def release_results(self):
+        """
+        Release the views of the buffer held by results of the previous call to feed and
+        return them to the protocol's result pool
+        """
+        for result in self.issued_results:
+            self.protocol.release_result(result)
+        self.issued_results = []
+
+    def compact(self):
+        """Remove bytes that are no longer needed from the front of the buffer"""
+        if self.state == self.SEARCHING:
+            offset = self.index
+        else:
+            offset = self.packet_start
+        if offset == 0:
+            return
+        try:
+            del self.buffer[:offset]
+        except BufferError:
+            # something is still holding a view of the buffer. Leave it with the old buffer
+            self.buffer = self.buffer[offset:]
+        self.index -= offset
+        self.packet_start -= offset
+        self.packet_stop -= offset
+
+    def pop_debug_messages(self) -> bytes:
+        """
+        Remove and return all complete debug messages. If a partial message exceeds max_debug_len,
+        it's returned as is
+        """
+        if len(self.debug_buffer) > self.max_debug_len:
+            stop_index = len(self.debug_buffer)
+        else:
+            stop_index = self.debug_buffer.rfind(b'\n') + 1
+        if stop_index == 0:
+            return b""
+        messages = bytes(self.debug_buffer[:stop_index])
+        del self.debug_buffer[:stop_index]
+        return messages
+
+    def get_unparsed(self) -> bytes:
+        """Return bytes that haven't been parsed into packets or debug messages yet"""
+        return bytes(self.debug_buffer + self.buffer)
+
+    def clear(self):
+        """Discard all unparsed bytes and reset the parse state"""
+        self.release_results()
+        self.buffer = bytearray()
+        self.debug_buffer.clear()
+        self.state = self.SEARCHING
+        self.index = 0
+        self.packet_start = 0
+        self.packet_stop = 0
+
+    def __len__(self):
+        return len(self.buffer)
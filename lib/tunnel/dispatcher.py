@@ -0,0 +1,132 @@
+import asyncio
+import inspect
+import warnings
+from collections import deque
+
+from .util import *
+from .result import PacketResult
+from .stats import PacketErrorStats
+
+
+class CallbackDispatcher:
+    """
+    Routes packet results to callbacks registered by category. The callbacks of each category are compiled
+    into a tuple ahead of time so a result for a category nobody handles costs a single dictionary lookup.
+
+    Plain functions are called inline. Coroutine functions are awaited one at a time unless concurrent is True.
+    In that case, they're run as tasks with at most max_in_flight running per category. Results of a category
+    that's at its limit are queued, so a slow callback for one category doesn't hold up the others.
+    If max_queued results of a category are waiting, the oldest is dropped to make room for the newest.
+    """
+
+    def __init__(self, concurrent=False, max_in_flight=4, max_queued=64, error_stats: PacketErrorStats = None):
+        """
+        :param concurrent: If True, run coroutine callbacks as tasks instead of awaiting them
+        :param max_in_flight: maximum number of running callback tasks per category
+        :param max_queued: maximum number of callbacks waiting per category. If less than or equal to 0,
+            there's no limit
+        :param error_stats: if not None, dropped results are counted here as CALLBACK_QUEUE_FULL_ERROR
+        """
+        self.concurrent = concurrent
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.error_stats = error_stats
+        self.num_dropped = 0  # number of queued callbacks dropped because their category's queue was full
+
+        # format is {"category1": ((callback1, is_async), (callback2, is_async), ...), ...}
+        self.table = {}
+
+        self.in_flight = {}  # {"category": number of running callback tasks}
+        self.queued = {}  # {"category": deque([(callback, result), ...])} callbacks waiting for a free slot
+        self.tasks = set()  # running callback tasks. Referenced here so they aren't garbage collected
+
+    def set_callbacks(self, category: str, callbacks: list):
+        """
+        Compile the callbacks of a category into the dispatch table
+        :param category: category to trigger callbacks
+        :param callbacks: list of callable objects. Called with a PacketResult
+        :return: None
+        """
+        if len(callbacks) == 0:
+            self.table.pop(category, None)
+        else:
+            self.table[category] = tuple(
+                (callback, asyncio.iscoroutinefunction(callback)) for callback in callbacks
+            )
+
+    async def dispatch(self, result: PacketResult):
+        """Run all callbacks registered for the result's category"""
+        callbacks = self.table.get(result.category)
+        if callbacks is None:
+            return
+        is_kept = False
+        for callback, is_async in callbacks:
+            if not is_async:
+                # callable objects may still return a coroutine
+                value = callback(result)
+                if value is not None and inspect.isawaitable(value):
+                    await value
+            elif self.concurrent:
+                if not is_kept:
+                    # the task may run after the receive buffer is reused
+                    result.keep()
+                    is_kept = True
+                self.schedule(result.category, callback, result)
+            else:
+                await callback(result)
+
+    def schedule(self, category: str, callback, result: PacketResult):
+        """
+        Start a callback task or queue it if the category has max_in_flight tasks running.
+        Results queue behind any already waiting so each category runs in the order results arrived
+        """
+        if self.in_flight.get(category, 0) >= self.max_in_flight or category in self.queued:
+            if category not in self.queued:
+                self.queued[category] = deque()
+            queue = self.queued[category]
+            if 0 < self.max_queued <= len(queue):
+                self.drop_oldest(queue)
+            queue.append((callback, result))
+            return
+        self.start_task(category, callback, result)
+
+    def start_task(self, category: str, callback, result: PacketResult):
+        """Run a callback as a task and count it against the category's max_in_flight"""
+        self.in_flight[category] = self.in_flight.get(category, 0) + 1
+        task = asyncio.ensure_future(callback(result))
+        self.tasks.add(task)
+        task.add_done_callback(lambda done_task: self.on_task_done(category, done_task))
+
+    def drop_oldest(self, queue: deque):
+        """Drop the oldest queued callback of a category that's at max_queued"""
+        callback, result = queue.popleft()
+        self.num_dropped += 1
+        if self.error_stats is not None:
+            self.error_stats.record(CALLBACK_QUEUE_FULL_ERROR, result.get_packet(), result.recv_time)
+            self.error_stats.warn_summary()
+
+    def on_task_done(self, category: str, task: asyncio.Task):
+        """Report any exception raised by the callback and start the next queued callback for the category"""
+        self.tasks.discard(task)
+        self.in_flight[category] -= 1
+        if not task.cancelled() and task.exception() is not None:
+            warnings.warn("Callback for '%s' raised an exception: %s" % (category, repr(task.exception())))
+
+        # a callback may end in CancelledError on its own (an inner wait_for for example). Start the next one
+        # regardless. cancel clears the queues so nothing is started after the dispatcher is cancelled
+        queue = self.queued.get(category)
+        if queue is not None:
+            callback, result = queue.popleft()
+            if len(queue) == 0:
+                del self.queued[category]
+            self.start_task(category, callback, result)
+
+    def get_num_pending(self) -> int:
+        """Number of callbacks running or waiting to run"""
+        return len(self.tasks) + sum([len(queue) for queue in self.queued.values()])
+
+    def cancel(self):
+        """Cancel running callback tasks and drop queued callbacks"""
+        self.queued.clear()
+        for task in list(self.tasks):
+            task.cancel()
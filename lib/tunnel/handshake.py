@@ -1,4 +1,7 @@
 import time
+import heapq
+import random
+import itertools
 from .util import *
 from .result import PacketResult
 
@@ -28,6 +31,10 @@ class Handshake:
         self.attempt_counter = 0
         self.error_code = NULL_ERROR
 
+        # time to wait before the next write. Starts as write_interval. HandshakeTable replaces it with
+        # an adaptive interval if it's given a RetransmitTimer
+        self.retransmit_interval = write_interval
+
     @classmethod
     def from_result(cls, packet_result: PacketResult):
         """
@@ -38,7 +45,7 @@ class Handshake:
         """
         packet_num = packet_result.get_int()
         error_code = packet_result.get_int()
-        self = cls(packet_result.category, packet_result.get_packet(), packet_num, 0.0, 0.0)
+        self = cls(packet_result.category, bytes(packet_result.get_packet()), packet_num, 0.0, 0.0)
         self.error_code = error_code
         return self
 
@@ -54,6 +61,18 @@ class Handshake:
         else:
             return False
 
+    def get_next_write_time(self):
+        """Time the packet should be written again. None if it's never written again"""
+        if self.write_interval <= 0.0:
+            return None
+        return self.prev_write_time + self.retransmit_interval
+
+    def get_expire_time(self):
+        """Time the handshake fails if it hasn't been confirmed. None if it never expires"""
+        if self.timeout <= 0.0:
+            return None
+        return self.initial_write_time + self.timeout
+
     def did_fail(self):
         if self.timeout > 0.0:
             return time.time() - self.initial_write_time > self.timeout
@@ -75,3 +94,170 @@ class Handshake:
         return f"{self.__class__.__name__}('{self.category}', {self.packet}, {self.packet_num}, {self.write_interval}, {self.timeout})"
 
     __repr__ = __str__
+
+
+class RetransmitTimer:
+    """
+    Estimates how long to wait for a confirming packet before writing a handshake again from observed
+    confirm round trip times. Follows TCP's retransmission timer (RFC 6298): a smoothed round trip time plus
+    four times its variation. Each retry doubles the wait and jitter keeps handshakes from resending in lockstep.
+    """
+
+    def __init__(self, min_timeout=0.05, max_timeout=2.0, jitter=0.1):
+        """
+        :param min_timeout: lower bound of the estimated timeout in seconds
+        :param max_timeout: upper bound of the timeout in seconds, including backoff
+        :param jitter: the interval is randomly scaled by up to this fraction in either direction
+        """
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.jitter = jitter
+
+        self.smoothed_rtt = None  # None until the first round trip time is measured
+        self.rtt_variation = 0.0
+        self.timeout = None  # estimated retransmit timeout. None until the first round trip time is measured
+        self.num_samples = 0
+
+    def add_sample(self, rtt: float):
+        """
+        Update the estimate with a measured round trip time. Only measure handshakes that were written once,
+        otherwise it's unknown which write was confirmed
+        :param rtt: time in seconds between writing a handshake and receiving its confirming packet
+        """
+        if self.smoothed_rtt is None:
+            self.smoothed_rtt = rtt
+            self.rtt_variation = rtt / 2.0
+        else:
+            self.rtt_variation = 0.75 * self.rtt_variation + 0.25 * abs(self.smoothed_rtt - rtt)
+            self.smoothed_rtt = 0.875 * self.smoothed_rtt + 0.125 * rtt
+        self.timeout = min(max(self.smoothed_rtt + 4.0 * self.rtt_variation, self.min_timeout), self.max_timeout)
+        self.num_samples += 1
+
+    def get_interval(self, attempt: int, default: float) -> float:
+        """
+        :param attempt: number of times the handshake has been written again so far
+        :param default: interval to back off from if no round trip times have been measured yet
+        :return: seconds to wait before writing the handshake again
+        """
+        if self.timeout is None:
+            timeout = default
+        else:
+            timeout = self.timeout
+        interval = min(timeout * (2 ** attempt), self.max_timeout)
+        return interval * random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__name__}(srtt={self.smoothed_rtt}, rttvar={self.rtt_variation}, timeout={self.timeout})"
+
+    __repr__ = __str__
+
+
+class HandshakeTable:
+    """
+    Pending handshakes keyed by (category, packet_num) with a min-heap of retransmit and expiry deadlines.
+    Confirming a handshake is a dictionary lookup and pop_due only looks at handshakes whose deadline has passed.
+    Expired handshakes are removed from the table.
+    Deadlines of handshakes that were confirmed are left in the heap and skipped when they come up.
+    """
+
+    # deadline types
+    RETRANSMIT = 0
+    EXPIRE = 1
+
+    def __init__(self):
+        self.handshakes = {}  # {(category, packet_num): Handshake}
+        self.deadlines = []  # heap of (deadline time, sequence number, deadline type, Handshake)
+        self.sequence = itertools.count()  # breaks ties between equal deadlines so handshakes are never compared
+
+    def add(self, handshake: Handshake, retransmit_timer=None):
+        """
+        Start tracking a handshake that was just written
+        :param handshake: Handshake to track
+        :param retransmit_timer: If not None, RetransmitTimer that determines when the handshake is written again
+            instead of its fixed write_interval
+        """
+        if retransmit_timer is not None and handshake.write_interval > 0.0:
+            handshake.retransmit_interval = retransmit_timer.get_interval(0, handshake.write_interval)
+        self.handshakes[(handshake.category, handshake.packet_num)] = handshake
+        write_time = handshake.get_next_write_time()
+        if write_time is not None:
+            self.push_deadline(write_time, self.RETRANSMIT, handshake)
+        expire_time = handshake.get_expire_time()
+        if expire_time is not None:
+            self.push_deadline(expire_time, self.EXPIRE, handshake)
+
+    def push_deadline(self, deadline: float, deadline_type: int, handshake: Handshake):
+        heapq.heappush(self.deadlines, (deadline, next(self.sequence), deadline_type, handshake))
+
+    def pop(self, category: str, packet_num: int):
+        """
+        Stop tracking a handshake that was confirmed
+        :return: the pending Handshake or None if no handshake matches
+        """
+        return self.handshakes.pop((category, packet_num), None)
+
+    def is_pending(self, handshake: Handshake) -> bool:
+        """Check if this handshake object is still waiting for a confirming packet"""
+        return self.handshakes.get((handshake.category, handshake.packet_num)) is handshake
+
+    def pop_due(self, current_time=None, retransmit_timer=None) -> tuple:
+        """
+        Find handshakes whose deadlines passed. Expired handshakes are removed from the table
+        :param current_time: time to compare deadlines with. Defaults to time.time()
+        :param retransmit_timer: If not None, RetransmitTimer that backs off the next write of each handshake
+        :return: Tuple[List[Handshake], List[Handshake]] handshakes to write again, handshakes that expired
+        """
+        deadlines = self.deadlines
+        if len(deadlines) == 0:
+            return [], []
+        if current_time is None:
+            current_time = time.time()
+        to_write = []
+        expired = []
+        while len(deadlines) > 0 and deadlines[0][0] < current_time:
+            deadline, _, deadline_type, handshake = heapq.heappop(deadlines)
+            if not self.is_pending(handshake):
+                continue  # confirmed or expired already
+            if deadline_type == self.EXPIRE:
+                del self.handshakes[(handshake.category, handshake.packet_num)]
+                expired.append(handshake)
+                continue
+            handshake.prev_write_time = current_time
+            handshake.attempt_counter += 1
+            if retransmit_timer is not None:
+                handshake.retransmit_interval = retransmit_timer.get_interval(
+                    handshake.attempt_counter, handshake.write_interval)
+            to_write.append(handshake)
+            self.push_deadline(handshake.get_next_write_time(), self.RETRANSMIT, handshake)
+
+        # don't write handshakes again that expired in the same round
+        if len(expired) > 0 and len(to_write) > 0:
+            to_write = [handshake for handshake in to_write if self.is_pending(handshake)]
+        return to_write, expired
+
+    def get_next_deadline(self):
+        """
+        Earliest retransmit or expiry time. May belong to a handshake that was already confirmed
+        :return: float or None if no deadlines are scheduled
+        """
+        if len(self.deadlines) == 0:
+            return None
+        return self.deadlines[0][0]
+
+    def clear(self):
+        self.handshakes.clear()
+        self.deadlines.clear()
+
+    def __contains__(self, handshake: Handshake) -> bool:
+        return (handshake.category, handshake.packet_num) in self.handshakes
+
+    def __iter__(self):
+        return iter(list(self.handshakes.values()))
+
+    def __len__(self) -> int:
+        return len(self.handshakes)
+
+    def __str__(self) -> str:
+        return str(list(self.handshakes.values()))
+
+    __repr__ = __str__
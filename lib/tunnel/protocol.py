@@ -1,7 +1,11 @@
 import time
 import warnings
+from collections import namedtuple
 from .result import PacketResult
 from .handshake import Handshake
+from .codec import FormatCodec, get_format_codec
+from .stats import PacketErrorStats
+from .template import PacketTemplate
 from .util import *
 
 
@@ -61,6 +65,19 @@ class TunnelProtocol:
         self.buffer_index = 0  # after a packet has been verified, this tracks where the next segment starts
         self.current_segment = b''  # raw data contained within the last segment
         self.use_double_precision = True  # If True, use 8 byte floats. If False, use 4 byte floats
+        self.format_codecs = {}  # compiled FormatCodec for each format string passed to make_packet
+
+        # If True, PacketResult buffers are memoryviews of the receive buffer instead of copies.
+        # Results are only valid until the receive buffer is modified unless PacketResult.keep is called
+        self.zero_copy = False
+
+        # optional PacketResultPool. If set, parsed results are taken from the pool and are reused once they're
+        # released. Results are only valid until the next parse unless PacketResult.keep is called
+        self.result_pool = None
+
+        # categories whose data segments are decoded while parsing. Format is {"category": (formats, values_type)}
+        # where values_type is a namedtuple class or None. Refer to register_schema
+        self.schemas = {}
 
         # mapping of packet codes to printable strings
         self.packet_error_codes = {
@@ -77,8 +94,17 @@ class TunnelProtocol:
             PACKET_STOP_ERROR: "packet didn't end with stop character",
             SEGMENT_TOO_LONG_ERROR: "packet segment is too long",
             PACKET_TIMEOUT_ERROR: "packet receive timed out",
+            PACKET_TYPE_NOT_FOUND_ERROR: "invalid packet type",
+            CALLBACK_QUEUE_FULL_ERROR: "callback queue full. Oldest queued result dropped",
         }
 
+        # counts of malformed packets by error code and a sample of recent ones.
+        # A summary is warned at most once every error_stats.summary_interval seconds
+        self.error_stats = PacketErrorStats(self.packet_error_codes)
+
+        # If True, warn with the full packet for every malformed packet instead of periodic summaries
+        self.verbose_errors = debug
+
         self.minimum_packet = self.make_packet("x", "")  # create the smallest packet
         self.write_packet_num = 0  # reset write_packet_num again
         self.min_packet_len = len(self.minimum_packet)  # determine minimum packet length from smallest packet
@@ -87,6 +113,49 @@ class TunnelProtocol:
         # or the maximum value of 2 bytes since that's maximum length allowed for string parsing in this protocol
         self.max_segment_len = min(self.max_packet_len - self.min_packet_len, 0xffff)
 
+    def register_schema(self, category: str, formats: str, names=None):
+        """
+        Register the data segment format of a category. Packets of this category have all of their values
+        decoded in a single struct.unpack_from call while parsing. Access them with PacketResult.get_values
+        :param category: str, category of packet
+        :param formats: str, format of the data segment. Refer to make_packet for keys. Strings aren't supported
+        :param names: optional list of field names or a space separated string.
+            If provided, values are returned as a namedtuple
+        :return: None
+        """
+        codec = self.get_format_codec(formats)
+        if not codec.is_valid or codec.has_strings:
+            raise TunnelProtocolException("Invalid schema format for '%s' category: %s" % (category, repr(formats)))
+        if names is None:
+            values_type = None
+        else:
+            if isinstance(names, str):
+                names = names.split()
+            if len(names) != len(formats):
+                raise ValueError("Number of names doesn't match number of format keys: %s != %s" % (names, formats))
+            values_type = namedtuple("PacketValues", names)
+        self.schemas[category] = (formats, values_type)
+
+    def decode_values(self, category: str, buffer, start_index: int, stop_index=None):
+        """
+        Decode the data segment of a packet using the category's registered schema
+        :param category: str, category of packet. Must be registered with register_schema
+        :param buffer: bytes-like object containing the data segment
+        :param start_index: where the data segment starts in the buffer
+        :param stop_index: where the data segment stops in the buffer. Defaults to the end of the buffer
+        :return: tuple or namedtuple of values. None if the data segment is too short
+        """
+        formats, values_type = self.schemas[category]
+        codec = self.get_format_codec(formats)
+        if stop_index is None:
+            stop_index = len(buffer)
+        if stop_index - start_index < codec.size:
+            return None
+        values = codec.unpack_from(buffer, start_index)
+        if values_type is not None:
+            values = values_type._make(values)
+        return values
+
     def make_handshake_packet(self, category: str, *args, write_interval=0.0, timeout=1.0) -> Handshake:
         """
         Create a Handshake packet. The purpose of this packet is to ensure the device got the message
@@ -102,18 +171,19 @@ class TunnelProtocol:
         packet = self.make_packet(category, *args, packet_type=PACKET_TYPE_HANDSHAKE)
         return Handshake(category, packet, self.write_packet_num - 1, write_interval, timeout)
 
-    def make_confirming_packet(self, category, packet_num) -> bytes:
+    def make_confirming_packet(self, category, packet_num, error_code=NO_ERROR) -> bytes:
         """
         Create a confirming packet. This packet is sent in response to receiving a handshake packet type.
         Its contents are the packet number the confirming packet is responding to and the client's error code for
         the handshake packet.
         :param category: str, category of packet. For packet routing on the receiving end. Must not contain:
             util.PACKET_SEP_STR (\t)
-        :param formats: str, how to parse each of the provided arguments. Refer to make_packet for keys.
         :param packet_num: Packet number of the handshake packet
+        :param error_code: error code encountered while parsing the handshake packet
         :return: bytes
         """
-        return self.make_packet(category, packet_num, packet_type=PACKET_TYPE_CONFIRMING)
+        return self.make_packet(category, CONFIRMING_FORMATS, packet_num, error_code,
+                                packet_type=PACKET_TYPE_CONFIRMING)
 
     def make_packet(self, category: str, formats: str, *args, packet_type=PACKET_TYPE_NORMAL) -> bytes:
         """
@@ -139,6 +209,125 @@ class TunnelProtocol:
         packet = self.packet_header(category, packet_type)  # start packet with the protocol header
         if len(args) != len(formats):
             raise ValueError("Number of provided arguments doesn't match number of format keys: %s (%s) != %s (%s)" % (str(args), len(args), formats, len(formats)))
+
+        # pack all arguments at once using the compiled format. Fall back to packing arguments one at a time
+        # if the codec doesn't accept the argument types
+        payload = self.get_format_codec(formats).pack(args, self.max_segment_len)
+        if payload is None:
+            payload = self.pack_arguments(formats, args)
+        packet += payload
+
+        packet = self.packet_footer(packet)  # append footer as well as insert length bytes into the beginning
+        if len(packet) > self.max_packet_len:
+            raise TunnelProtocolException("Packet exceeds maximum allowable length: %s" % repr(packet))
+        if len(packet) < self.min_packet_len:
+            raise TunnelProtocolException("Packet exceeds minimum allowable length: %s" % repr(packet))
+
+        self.write_packet_num += 1
+        return packet
+
+    def make_packet_template(self, category: str, formats: str, *args, packet_type=PACKET_TYPE_NORMAL) -> PacketTemplate:
+        """
+        Encode a packet once so it can be written to many tunnels with make_packet_from_template.
+        Doesn't change write_packet_num. Refer to make_packet for arguments
+        :return: PacketTemplate
+        """
+        packet_num = self.write_packet_num
+        self.write_packet_num = 0
+        try:
+            packet = self.make_packet(category, formats, *args, packet_type=packet_type)
+        finally:
+            self.write_packet_num = packet_num
+        return PacketTemplate(category, packet)
+
+    def make_packet_from_template(self, template: PacketTemplate) -> bytes:
+        """
+        Create a packet from a template with this protocol's packet count
+        :param template: PacketTemplate made by make_packet_template
+        :return: bytes
+        """
+        packet = template.make_packet(self.write_packet_num)
+        self.write_packet_num += 1
+        return packet
+
+    def make_packets_into(self, buffer: bytearray, messages, packet_type=PACKET_TYPE_NORMAL) -> int:
+        """
+        Create many packets and append them back to back to a buffer. Packets are numbered consecutively.
+        Each packet is serialized in place: the header, data segment, and footer are packed directly into the
+        buffer and the checksum is computed over the appended bytes, so no intermediate packet is created.
+        If any message fails to be packed, the buffer and write_packet_num are restored and the exception is raised
+        :param buffer: bytearray to append the packets to. Can be reused between calls
+        :param messages: iterable of (category, formats, args) where args is a tuple of objects to interpret
+            into a packet. Refer to make_packet
+        :param packet_type: util.PACKET_TYPE_NORMAL, util.PACKET_TYPE_HANDSHAKE, or util.PACKET_TYPE_CONFIRMING
+        :return: int, number of bytes appended to the buffer
+        """
+        start_len = len(buffer)
+        start_packet_num = self.write_packet_num
+        try:
+            for category, formats, args in messages:
+                self.make_packet_into(buffer, category, formats, args, packet_type)
+        except BaseException:
+            del buffer[start_len:]
+            self.write_packet_num = start_packet_num
+            raise
+        return len(buffer) - start_len
+
+    def make_packet_into(self, buffer: bytearray, category: str, formats: str, args: tuple, packet_type: int):
+        """
+        Append a packet to a buffer. Creates the same bytes as make_packet. Used by make_packets_into,
+        which restores the buffer if an exception is raised
+        """
+        if len(args) != len(formats):
+            raise ValueError("Number of provided arguments doesn't match number of format keys: %s (%s) != %s (%s)" % (str(args), len(args), formats, len(formats)))
+        category = self.encode_category(category)
+
+        # placeholder for the start, length, packet type, and packet count segments
+        packet_start = len(buffer)
+        buffer += PACKET_PREFIX_PLACEHOLDER
+        buffer += category
+        buffer += PACKET_SEP
+        if not self.get_format_codec(formats).pack_into(buffer, args, self.max_segment_len):
+            buffer += self.pack_arguments(formats, args)
+
+        # length counts from the packet type up to the end of the checksum
+        segments_start = packet_start + PACKET_HEADER_LENGTH
+        packet_len = len(buffer) - segments_start + PACKET_CHECKSUM_LENGTH
+        PACKET_PREFIX_STRUCT.pack_into(buffer, packet_start, PACKET_START, packet_len, packet_type, self.write_packet_num)
+
+        # checksum counts from the packet type to the end of the data
+        with memoryview(buffer)[segments_start:] as segments:
+            calc_checksum = sum(segments) & 0xff
+        buffer += CHECKSUM_FOOTER_BYTES[calc_checksum]
+
+        packet_len = len(buffer) - packet_start
+        if packet_len > self.max_packet_len:
+            raise TunnelProtocolException("Packet exceeds maximum allowable length: %s" % repr(buffer[packet_start:]))
+        if packet_len < self.min_packet_len:
+            raise TunnelProtocolException("Packet exceeds minimum allowable length: %s" % repr(buffer[packet_start:]))
+
+        self.write_packet_num += 1
+
+    def get_format_codec(self, formats: str) -> FormatCodec:
+        """
+        Return the compiled FormatCodec for a format string. Codecs are compiled once and
+        recompiled if use_double_precision changes
+        """
+        codec = self.format_codecs.get(formats)
+        if codec is None or codec.use_double_precision != self.use_double_precision:
+            codec = get_format_codec(formats, self.use_double_precision)
+            self.format_codecs[formats] = codec
+        return codec
+
+    def pack_arguments(self, formats: str, args: tuple) -> bytes:
+        """
+        Parse each argument into bytes one at a time. Used when the arguments don't match the
+        types expected by the compiled format codec
+        :param formats: str, how to parse each of the provided arguments. Refer to make_packet for keys.
+        :param args: objects to interpret into a packet. Accepted types: int, str, bytes, float
+        :return: bytes, data segment of the packet
+        """
+        packet = b""
         for index, key in enumerate(formats):
             arg = args[index]
             # Parse each argument into bytes and append them to the packet
@@ -179,14 +368,6 @@ class TunnelProtocol:
                 packet += len_bytes + arg
             else:
                 warnings.warn("Invalid argument type: %s, %s. key: %s" % (type(arg), arg, repr(key)))
-
-        packet = self.packet_footer(packet)  # append footer as well as insert length bytes into the beginning
-        if len(packet) > self.max_packet_len:
-            raise TunnelProtocolException("Packet exceeds maximum allowable length: %s" % repr(packet))
-        if len(packet) < self.min_packet_len:
-            raise TunnelProtocolException("Packet exceeds minimum allowable length: %s" % repr(packet))
-
-        self.write_packet_num += 1
         return packet
 
     def packet_header(self, category: str, packet_type: int) -> bytes:
@@ -194,13 +375,15 @@ class TunnelProtocol:
         Create segments that are included in the length count that aren't the data and the checksum:
         packet_type, write_packet_num, and category + util.PACKET_SEP
         """
+        return PACKET_HEADER_STRUCT.pack(packet_type, self.write_packet_num) + self.encode_category(category) + PACKET_SEP
+
+    @staticmethod
+    def encode_category(category: str) -> bytes:
+        """Encode a category. Raises TunnelProtocolException if it contains util.PACKET_SEP"""
         category = str(category).encode()
         if PACKET_SEP in category:
             raise TunnelProtocolException("Cannot have %s in the category: %s" % (PACKET_SEP, repr(category)))
-        packet = to_uint8_bytes(packet_type)
-        packet += to_int_bytes(self.write_packet_num, 4, signed=False)
-        packet += category + PACKET_SEP
-        return packet
+        return category
 
     def packet_footer(self, packet: bytes) -> bytes:
         """
@@ -211,29 +394,30 @@ class TunnelProtocol:
         """
         calc_checksum = self.calculate_checksum(packet)
 
-        packet += b"%02x" % calc_checksum  # convert checksum int to hexadecimal string
-
-        packet_len = len(packet)  # calculate length starting from length bytes up to the end of the checksum
-        packet_len_bytes = to_uint16_bytes(packet_len)  # encode length as 2 bytes
-
-        packet = PACKET_START_0 + PACKET_START_1 + packet_len_bytes + packet  # insert starting and length bytes
-        packet += PACKET_STOP  # append stop byte
+        # length counts from the packet type up to the end of the checksum
+        packet_len_bytes = to_uint16_bytes(len(packet) + PACKET_CHECKSUM_LENGTH)  # encode length as 2 bytes
 
-        return packet
+        # insert starting and length bytes, append checksum as a hexadecimal string and the stop byte
+        return b"".join((PACKET_START, packet_len_bytes, packet, CHECKSUM_HEX_BYTES[calc_checksum], PACKET_STOP))
 
     @staticmethod
     def calculate_checksum(packet: bytes) -> int:
         """
         Calculate checksum from provided bytes. Should include length, packet count, category, and data bytes only
-        :param packet: bytes, Packet to calculate checksum from
+        The 8-bit sum is computed by sum() which iterates over the bytes in C
+        :param packet: bytes-like object (bytes, bytearray, or memoryview), Packet to calculate checksum from
         :return: int, encoding the checksum
         """
-        calc_checksum = 0
-        for val in packet:
-            calc_checksum += val
-        calc_checksum &= 0xff
+        return sum(packet) & 0xff
 
-        return calc_checksum
+    @staticmethod
+    def calculate_checksums(packets) -> list:
+        """
+        Calculate checksums of many packets in one call. Refer to calculate_checksum
+        :param packets: iterable of bytes-like objects
+        :return: List[int], checksum of each packet
+        """
+        return [sum(packet) & 0xff for packet in packets]
 
     @staticmethod
     def extract_checksum(packet: bytes) -> int:
@@ -244,8 +428,8 @@ class TunnelProtocol:
         """
         try:
             return int(packet[-2:], 16)
-        except ValueError as e:
-            warnings.warn("Failed to parse checksum as int: %s" % str(e))
+        except ValueError:
+            # -1 never matches a calculated checksum. The packet is reported as a checksum error
             return -1
 
     def parse_buffer(self, buffer: bytes) -> tuple:
@@ -258,122 +442,161 @@ class TunnelProtocol:
             trailing bytes in the buffer not used for packet parsing,
             list of PacketResult's (empty if no packets parsed)
         """
-        index = -1  # index is incremented immediately, start from -1 to capture index #0
         results = []  # store packet results here
         last_packet_index = 0  # index of last PACKET_STOP encountered that had start bytes and correct length
-        remaining_buffer = b""  # store debug statement bytes here
-
-        # iterate over the entire buffer one character at a time
-        while index < len(buffer):
-            index += 1
-            packet_start = index  # if the checks below pass, packet_start will remain at the beginning of the packet
+        debug_ranges = []  # (start, stop) offsets of debug statement bytes. Joined once at the end
+        buffer_len = len(buffer)
+        start_1 = PACKET_START_1[0]
+        stop_byte = PACKET_STOP[0]
+        index = 0  # where to resume searching for util.PACKET_START_0
+
+        # jump between start markers instead of stepping through the buffer one character at a time
+        while index < buffer_len:
+            packet_start = buffer.find(PACKET_START_0, index)
+            if packet_start == -1:
+                # assume data that doesn't start with util.PACKET_START_0 is part of a debug message
+                debug_ranges.append((index, buffer_len))
+                break
+            if packet_start > index:
+                debug_ranges.append((index, packet_start))
 
-            # assume data that doesn't start with util.PACKET_START_0 is part of a debug message
-            if buffer[index:index + 1] != PACKET_START_0:
-                remaining_buffer += buffer[index:index + 1]
-                continue
-            index += PACKET_START_LENGTH  # move to the next index if util.PACKET_START_0 is encountered
-            if index >= len(buffer):
+            start_1_index = packet_start + PACKET_START_LENGTH
+            if start_1_index >= buffer_len:
                 # exit if the buffer is overrun, the packet is incomplete
                 break
 
             # assume data that doesn't start with util.PACKET_START_1 is part of a debug message
-            if buffer[index:index + 1] != PACKET_START_1:
-                remaining_buffer += buffer[index:index + 1]
+            if buffer[start_1_index] != start_1:
+                debug_ranges.append((start_1_index, start_1_index + 1))
+                index = start_1_index + 1
                 continue
-            index += PACKET_START_LENGTH  # move to the next index if util.PACKET_START_1 is encountered
-            if index >= len(buffer):
-                # exit if the buffer is overrun, the packet is incomplete
-                break
 
-            raw_length = buffer[index:index + 2]  # per definition, next two bytes must be length
-            # length must be between 0 and the length of the remaining buffer.
-            if len(raw_length) == 0:
-                # length is invalid. Start searching for packet start
-                continue
-            if index + PACKET_LEN_LENGTH >= len(buffer):
+            length_index = start_1_index + PACKET_START_LENGTH  # per definition, next two bytes must be length
+            if length_index + PACKET_LEN_LENGTH >= buffer_len:
                 # exit if the buffer is overrun, the packet is incomplete
                 break
-            index += PACKET_LEN_LENGTH  # move index to after the length bytes. This is where length is calculated from
+            body_index = length_index + PACKET_LEN_LENGTH  # this is where length is calculated from
 
-            length = to_int(raw_length, signed=False)  # interpret two length bytes as an integer
-            if index + length >= len(buffer):
+            # interpret two length bytes as an integer
+            length = (buffer[length_index] << 8) | buffer[length_index + 1]
+            stop_index = body_index + length
+            if stop_index >= buffer_len:
                 # exit if the buffer is overrun, the packet is incomplete
                 break
-            if buffer[index + length: index + length + 1] != PACKET_STOP:
+            if buffer[stop_index] != stop_byte:
                 # packet doesn't end with util.PACKET_STOP, it must be corrupted. Search for a new packet
-                # from the next index onward
+                # after the first byte following the length bytes
+                index = body_index + 1
                 continue
-            index += length  # move the specified number of bytes along the buffer
-
-            # from this point don't modify index otherwise parts of the next packet will be skipped
-            # since the index immediately gets incremented at the beginning of the loop
-            last_packet_index = index + 1  # include util.PACKET_STOP in last_packet_index
-            packet = buffer[packet_start:last_packet_index]  # slice buffer according to start and stop
-            if self.debug:
-                print("Received packet:", packet)
-            result = self.parse_packet(packet)  # parse found packet into PacketResult
-            if result.error_code != NO_ERROR:
-                self.dropped_packet_num += 1  # any error code that isn't util.NO_ERROR counts as a dropped packet
-            self.read_packet_num += 1
-            results.append(result)
 
+            last_packet_index = stop_index + 1  # include util.PACKET_STOP in last_packet_index
+            index = last_packet_index
+            # parse the packet in place according to start and stop
+            results.append(self.parse_found_packet(buffer, packet_start, last_packet_index))
+
+        # debug bytes are only copied once, without intermediate concatenations
+        with memoryview(buffer) as view:
+            remaining_buffer = b"".join([view[start:stop] for start, stop in debug_ranges])
         return remaining_buffer, buffer[last_packet_index:], results
 
+    def parse_found_packet(self, buffer, start=0, stop=None) -> PacketResult:
+        """
+        Parse a packet found in a stream of bytes and update the receive counters
+        :param buffer: bytes or bytearray containing the packet
+        :param start: index of the packet's start bytes in the buffer
+        :param stop: index after the packet's util.PACKET_STOP in the buffer. Defaults to the end of the buffer
+        :return: PacketResult
+        """
+        if stop is None:
+            stop = len(buffer)
+        if self.debug:
+            print("Received packet:", bytes(buffer[start:stop]))
+        result = self.parse_packet_from(buffer, start, stop)  # parse found packet into PacketResult
+        if result.error_code != NO_ERROR:
+            self.dropped_packet_num += 1  # any error code that isn't util.NO_ERROR counts as a dropped packet
+        self.read_packet_num += 1
+        return result
+
+    def make_result(self, error_code, recv_time, packet_num) -> PacketResult:
+        """Create a PacketResult. Reuses a released result if a result pool is set"""
+        if self.result_pool is None:
+            return PacketResult(error_code, recv_time, packet_num)
+        return self.result_pool.get(error_code, recv_time, packet_num)
+
+    def release_result(self, result: PacketResult):
+        """Release a result's view of the receive buffer and return it to the result pool if one is set"""
+        result.release()
+        if self.result_pool is not None:
+            self.result_pool.put(result)
+
     def parse_packet(self, packet: bytes) -> PacketResult:
         """
         Parse received bytes identified as a potential valid packet into PacketResult
         :param packet: bytes to parse
         :return: PacketResult
         """
+        return self.parse_packet_from(packet, 0, len(packet))
+
+    def parse_packet_from(self, buffer, start: int, stop: int) -> PacketResult:
+        """
+        Parse a potential valid packet located between two indices of a receive buffer into PacketResult.
+        Segments are located by index so the packet isn't sliced while it's being verified.
+        If zero_copy is True, the PacketResult references the buffer through a memoryview instead of
+        copying the data segments. Refer to PacketResult.keep
+        :param buffer: bytes or bytearray containing the packet
+        :param start: index of the packet's start bytes in the buffer
+        :param stop: index after the packet's util.PACKET_STOP in the buffer
+        :return: PacketResult
+        """
         recv_time = time.time()
-        if len(packet) < self.min_packet_len:  # check minimum length constraint
-            warnings.warn("Packet is not the minimum length (%s): %s" % (self.min_packet_len, repr(packet)))
-            return PacketResult(PACKET_TOO_SHORT_ERROR, recv_time, self.read_packet_num)
-
-        if packet[0:1] != PACKET_START_0:  # verify packet actually starts with util.PACKET_START_0
-            warnings.warn("Packet does not start with PACKET_START_0: %s" % repr(packet))
-            return PacketResult(PACKET_0_ERROR, recv_time, self.read_packet_num)
-        if packet[1:2] != PACKET_START_1:  # verify packet actually starts with util.PACKET_START_1
-            warnings.warn("Packet does not start with PACKET_START_1: %s" % repr(packet))
-            return PacketResult(PACKET_1_ERROR, recv_time, self.read_packet_num)
-        if packet[-1:] != PACKET_STOP:  # verify packet actually ends with util.PACKET_STOP
-            warnings.warn("Packet does not stop with PACKET_STOP: %s" % repr(packet))
-            return PacketResult(PACKET_STOP_ERROR, recv_time, self.read_packet_num)
-
-        full_packet = packet  # sequester packet for debug printing
-        packet = packet[PACKET_HEADER_LENGTH:-1]  # remove start bytes, length, and stop bytes
-        calc_checksum = self.calculate_checksum(packet[:-PACKET_CHECKSUM_LENGTH])  # calculate checksum from packet
-        recv_checksum = self.extract_checksum(packet)  # extract checksum from packet
+        if stop - start < self.min_packet_len:  # check minimum length constraint
+            self.record_packet_error(PACKET_TOO_SHORT_ERROR, recv_time, buffer, start, stop,
+                                     "Packet is not the minimum length (%s)", self.min_packet_len)
+            return self.make_result(PACKET_TOO_SHORT_ERROR, recv_time, self.read_packet_num)
+
+        if buffer[start] != PACKET_START_0[0]:  # verify packet actually starts with util.PACKET_START_0
+            self.record_packet_error(PACKET_0_ERROR, recv_time, buffer, start, stop,
+                                     "Packet does not start with PACKET_START_0")
+            return self.make_result(PACKET_0_ERROR, recv_time, self.read_packet_num)
+        if buffer[start + 1] != PACKET_START_1[0]:  # verify packet actually starts with util.PACKET_START_1
+            self.record_packet_error(PACKET_1_ERROR, recv_time, buffer, start, stop,
+                                     "Packet does not start with PACKET_START_1")
+            return self.make_result(PACKET_1_ERROR, recv_time, self.read_packet_num)
+        if buffer[stop - 1] != PACKET_STOP[0]:  # verify packet actually ends with util.PACKET_STOP
+            self.record_packet_error(PACKET_STOP_ERROR, recv_time, buffer, start, stop,
+                                     "Packet does not stop with PACKET_STOP")
+            return self.make_result(PACKET_STOP_ERROR, recv_time, self.read_packet_num)
+
+        # packet type, count, category, and data are between the start bytes + length and the checksum
+        packet_start = start + PACKET_HEADER_LENGTH
+        packet_stop = stop - 1 - PACKET_CHECKSUM_LENGTH
+        if self.zero_copy:
+            packet = memoryview(buffer)[packet_start:packet_stop]
+        else:
+            packet = bytes(buffer[packet_start:packet_stop])
+        calc_checksum = self.calculate_checksum(packet)  # calculate checksum from packet
+        recv_checksum = self.extract_checksum(bytes(buffer[packet_stop:stop - 1]))  # extract checksum from packet
         if recv_checksum != calc_checksum:  # if they don't match, packet is corrupted
-            warnings.warn(
-                "Checksum failed! recv %02x != calc %02x. %s" % (recv_checksum, calc_checksum, repr(full_packet)))
-            return PacketResult(CHECKSUMS_DONT_MATCH_ERROR, recv_time, self.read_packet_num)
-
-        packet = packet[:-PACKET_CHECKSUM_LENGTH]  # remove checksum
+            self.record_packet_error(CHECKSUMS_DONT_MATCH_ERROR, recv_time, buffer, start, stop,
+                                     "Checksum failed! recv %02x != calc %02x", recv_checksum, calc_checksum)
+            return self.make_result(CHECKSUMS_DONT_MATCH_ERROR, recv_time, self.read_packet_num)
 
-        # everything in the buffer has been removed except for packet type, count, category, and data.
-        # Reset segment finder index
-        self.buffer_index = 0
-
-        # extract packet type byte and put it in self.current_segment
-        if not self.get_next_segment(packet, PACKET_TYPE_LENGTH):
-            warnings.warn("Failed to find packet number segment! %s" % (repr(full_packet)))
-            return PacketResult(PACKET_TYPE_NOT_FOUND_ERROR, recv_time, self.read_packet_num)
-        packet_type = to_int(self.current_segment, signed=False)  # parse packet type byte as an integer
+        # everything has been verified. Parse packet type, count, and category relative to packet_start.
+        # The packet is always long enough to contain packet type and count since it's at least min_packet_len
+        packet_type = buffer[packet_start]  # parse packet type byte as an integer
         if packet_type not in PACKET_TYPES:  # if not a valid packet type, signal a packet error
-            warnings.warn("Failed to find valid packet type! %s. Found: %s" % (repr(full_packet), packet_type))
-            return PacketResult(PACKET_TYPE_NOT_FOUND_ERROR, recv_time, self.read_packet_num)
+            self.record_packet_error(PACKET_TYPE_NOT_FOUND_ERROR, recv_time, buffer, start, stop,
+                                     "Failed to find valid packet type! Found: %s", packet_type)
+            return self.make_result(PACKET_TYPE_NOT_FOUND_ERROR, recv_time, self.read_packet_num)
 
-        # extract packet num bytes and put them in self.current_segment
-        if not self.get_next_segment(packet, PACKET_COUNT_LENGTH):
-            warnings.warn("Failed to find packet number segment! %s" % (repr(full_packet)))
-            return PacketResult(PACKET_COUNT_NOT_FOUND_ERROR, recv_time, self.read_packet_num)
-        self.recv_packet_num = to_int(self.current_segment, signed=False)  # parse four type bytes as an integer
+        count_start = packet_start + PACKET_TYPE_LENGTH
+        category_start = count_start + PACKET_COUNT_LENGTH
+        # parse four type bytes as an integer
+        self.recv_packet_num = int.from_bytes(buffer[count_start:category_start], 'big')
 
         # instantiate packet result we might return. If a non critical error occurs, we'll still return
         # a PacketResult with everything we found just with a "warning" error code
-        packet_result = PacketResult(NO_ERROR, recv_time, self.read_packet_num)
+        packet_result = self.make_result(NO_ERROR, recv_time, self.read_packet_num)
         packet_result.use_double_precision = self.use_double_precision
 
         # if this is the first packet received, reset count to match the just received packet
@@ -382,47 +605,85 @@ class TunnelProtocol:
 
         # signal a warning if packet count doesn't match. This potentially signals a dropped packet
         if self.recv_packet_num != self.read_packet_num:
-            warnings.warn("Received packet num doesn't match local count. "
-                          "recv %s != local %s" % (self.recv_packet_num, self.read_packet_num))
-            # print("Buffer: %s" % packet)
+            self.record_packet_error(PACKET_COUNT_NOT_SYNCED_ERROR, recv_time, buffer, start, stop,
+                                     "Received packet num doesn't match local count. recv %s != local %s",
+                                     self.recv_packet_num, self.read_packet_num)
             self.read_packet_num = self.recv_packet_num
             packet_result.set_error_code(PACKET_COUNT_NOT_SYNCED_ERROR)
 
-        # extract category bytes and put them in self.current_segment, delimited by util.PACKET_SEP
-        if not self.get_next_segment(packet, tab_separated=True):
-            warnings.warn(
-                "Failed to find category segment %s! %s" % (repr(self.current_segment), repr(full_packet)))
-            return PacketResult(PACKET_CATEGORY_ERROR, recv_time, self.read_packet_num)
+        # extract category bytes, delimited by util.PACKET_SEP
+        sep_index = buffer.find(PACKET_SEP, category_start, packet_stop)
+        if sep_index == -1:
+            category_stop = packet_stop
+            data_start = packet_stop
+        else:
+            category_stop = sep_index
+            data_start = sep_index + 1
+        category_segment = buffer[category_start:category_stop]
         try:
             # attempt to decode bytes to a string. If it fails, the category is invalid
-            category = self.current_segment.decode()
+            category = category_segment.decode()
         except UnicodeDecodeError:
-            warnings.warn("Category segment contains invalid characters: %s, %s" % (
-                repr(self.current_segment), repr(full_packet)))
-            return PacketResult(PACKET_CATEGORY_ERROR, recv_time, self.read_packet_num)
+            self.record_packet_error(PACKET_CATEGORY_ERROR, recv_time, buffer, start, stop,
+                                     "Category segment contains invalid characters: %r", bytes(category_segment))
+            return self.make_result(PACKET_CATEGORY_ERROR, recv_time, self.read_packet_num)
 
         if len(category) == 0:  # category must have at least length 1
-            warnings.warn("Category segment is empty: %s, %s" % (
-                repr(self.current_segment), repr(full_packet)))
-            return PacketResult(PACKET_CATEGORY_ERROR, recv_time, self.read_packet_num)
+            self.record_packet_error(PACKET_CATEGORY_ERROR, recv_time, buffer, start, stop,
+                                     "Category segment is empty: %r", bytes(category_segment))
+            return self.make_result(PACKET_CATEGORY_ERROR, recv_time, self.read_packet_num)
 
         if len(category) > self.max_segment_len:  # category must not exceed segment length
-            warnings.warn("Category segment is too large: %s, %s" % (
-                repr(self.current_segment), repr(full_packet)))
-            return PacketResult(PACKET_CATEGORY_ERROR, recv_time, self.read_packet_num)
-
-        # self.buffer_index is now at where the data starts
-        # Tell the PacketResult where the data starts and ends
-        packet_result.set_start_index(self.buffer_index)
-        packet_result.set_stop_index(len(packet) + 1)
+            self.record_packet_error(PACKET_CATEGORY_ERROR, recv_time, buffer, start, stop,
+                                     "Category segment is too large: %r", bytes(category_segment))
+            return self.make_result(PACKET_CATEGORY_ERROR, recv_time, self.read_packet_num)
+
+        # Tell the PacketResult where the data starts and ends relative to the packet
+        packet_result.set_start_index(data_start - packet_start)
+        packet_result.set_stop_index(packet_stop - packet_start + 1)
         packet_result.set_buffer(packet)
 
+        # decode all data segments at once if the category has a registered schema.
+        # Confirming packets contain the handshake's packet number and error code instead
+        if category in self.schemas and packet_type != PACKET_TYPE_CONFIRMING:
+            values = self.decode_values(category, buffer, data_start, packet_stop)
+            if values is None:
+                self.record_packet_error(INVALID_FORMAT_ERROR, recv_time, buffer, start, stop,
+                                         "Data segment doesn't match '%s' schema", category)
+                self.release_result(packet_result)
+                return self.make_result(INVALID_FORMAT_ERROR, recv_time, self.read_packet_num)
+            packet_result.set_values(values)
+
         # set category and packet type metadata
         packet_result.set_category(category)
         packet_result.set_type(packet_type)
 
+        # handshakes are confirmed with the sender's packet number
+        if packet_type == PACKET_TYPE_HANDSHAKE:
+            packet_result.set_packet_num(self.recv_packet_num)
+
         return packet_result
 
+    def record_packet_error(self, error_code: int, recv_time: float, buffer, start: int, stop: int, message: str,
+                            *args):
+        """
+        Count a malformed packet in error_stats. The message is only formatted and warned if verbose_errors is True.
+        Otherwise, a summary of recent errors is warned every error_stats.summary_interval seconds
+        :param error_code: int, error code of the packet. Refer to util
+        :param recv_time: time the packet was received
+        :param buffer: bytes or bytearray containing the packet
+        :param start: index of the packet's start bytes in the buffer
+        :param stop: index after the packet's util.PACKET_STOP in the buffer
+        :param message: description of the error. Formatted with args
+        :return: None
+        """
+        packet = bytes(buffer[start:stop])
+        self.error_stats.record(error_code, packet, recv_time)
+        if self.verbose_errors:
+            warnings.warn("%s: %s" % (message % args, repr(packet)))
+        else:
+            self.error_stats.warn_summary()
+
     def get_next_segment(self, buffer: bytes, length=None, tab_separated=False) -> bool:
         """
         Put data into self.current_segment according to two schema:
@@ -474,7 +735,11 @@ class TunnelProtocol:
         return result.packet_type == PACKET_TYPE_CONFIRMING
 
     def log_packet_error_code(self, error_code: int, packet_num=None):
-        """Print a warning if error code is an error. Interprets error_code int into a readable string"""
+        """
+        Print a warning if error code is an error. Interprets error_code int into a readable string.
+        Errors are already counted in error_stats while parsing. Unless verbose_errors is True, this only
+        warns the periodic summary
+        """
         if packet_num is None:
             packet_num = self.read_packet_num
         if error_code == NO_ERROR:
@@ -489,4 +754,7 @@ class TunnelProtocol:
             message += "\t%s" % self.packet_error_codes[error_code]
         else:
             message += "\tUnknown error code: %s" % error_code
-        warnings.warn(message)
+        if self.verbose_errors:
+            warnings.warn(message)
+        else:
+            self.error_stats.warn_summary()
@@ -17,8 +17,32 @@ class PacketResult:
         first = result.get_float()
         second = result.get_int()
         third = result.get_int()
+
+    If a schema is registered for the category with TunnelProtocol.register_schema("thing", "fdd"),
+    the values are already decoded:
+    if result.category == "thing":
+        first, second, third = result.get_values()
     """
+    __slots__ = (
+        "error_code",
+        "recv_time",
+        "category",
+        "buffer",
+        "start_index",
+        "stop_index",
+        "current_index",
+        "packet_type",
+        "packet_num",
+        "use_double_precision",
+        "values",
+        "is_kept",
+    )
+
     def __init__(self, error_code, recv_time, packet_num):
+        self.reset(error_code, recv_time, packet_num)
+
+    def reset(self, error_code, recv_time, packet_num):
+        """Set all properties to their initial values. Used by PacketResultPool to reuse results"""
         self.error_code = error_code
         self.recv_time = recv_time
 
@@ -30,7 +54,9 @@ class PacketResult:
         self.packet_type = PACKET_TYPE_NORMAL  # NORMAL, HANDSHAKE, or CONFIRMING
         self.packet_num = packet_num  # read packet number
         self.use_double_precision = True  # whether to use 8-byte or 4-byte precision in get_float. Set by protocol
-    
+        self.values = None  # all data segments decoded by the protocol if the category has a registered schema
+        self.is_kept = False  # whether keep was called. Kept results aren't returned to a PacketResultPool
+
     def set_start_index(self, index):
         """Set data segment start index. Used in protocol. Not for external use"""
         self.start_index = index
@@ -44,8 +70,41 @@ class PacketResult:
         """Set buffer. Used in protocol. Not for external use"""
         self.buffer = buffer
     
+    def set_values(self, values):
+        """Set decoded data segments. Used in protocol. Not for external use"""
+        self.values = values
+
+    def get_values(self):
+        """
+        Return all data segments decoded with the category's registered schema as a tuple or namedtuple.
+        Returns None if no schema is registered for the category
+        """
+        return self.values
+
     def get_packet(self):
         return self.buffer
+
+    def keep(self):
+        """
+        Copy the packet out of the shared receive buffer if the protocol is in zero copy mode and
+        prevent a PacketResultPool from reusing this result.
+        Call this if the result is used after the callbacks it was passed to return
+        :return: self
+        """
+        self.is_kept = True
+        if isinstance(self.buffer, memoryview):
+            packet = bytes(self.buffer)
+            self.buffer.release()
+            self.buffer = packet
+        return self
+
+    def release(self):
+        """
+        Release the result's view of the shared receive buffer if the protocol is in zero copy mode.
+        Data segments can't be read afterwards unless keep was called. Used in protocol. Not for external use
+        """
+        if isinstance(self.buffer, memoryview):
+            self.buffer.release()
     
     def set_error_code(self, error_code):
         """Set packet error code. Used in protocol. Not for external use"""
@@ -122,7 +181,7 @@ class PacketResult:
             length = to_int(self.buffer[self.current_index: next_index], signed=False)
 
         next_index = self.current_index + length
-        result = self.buffer[self.current_index: next_index].decode()
+        result = str(self.buffer[self.current_index: next_index], "utf-8")
         self.current_index = next_index
         self.check_index()
         return result
@@ -130,16 +189,9 @@ class PacketResult:
     def copy_from(self, other):
         if isinstance(other, self.__class__):
             raise AttributeError("Can't copy from a non-PacketResult object: %s" % repr(other))
-        self.error_code = other.error_code
-        self.recv_time = other.recv_time
-        self.category = other.category
-        self.buffer = other.buffer
-        self.start_index = other.start_index
-        self.stop_index = other.stop_index
-        self.current_index = other.current_index
-        self.packet_type = other.packet_type
-        self.packet_num = other.packet_num
-        self.use_double_precision = other.use_double_precision
+        other.keep()
+        for name in PacketResult.__slots__:
+            setattr(self, name, getattr(other, name))
 
     def __hash__(self) -> int:
         """Hash function for PacketResult. For comparing PacketResult objects for equality"""
@@ -155,7 +207,8 @@ class PacketResult:
     def __str__(self) -> str:
         return f"{self.__class__.__name__}<category={self.category}, error_code={self.error_code}, recv_time={self.recv_time}, packet_num={self.packet_num}, packet_type={self.packet_type}>"
 
-    def __del__(self):
+    def check_unparsed(self):
+        """Warn if some but not all data segments were parsed. Call after the result has been handled"""
         if self.current_index != self.start_index:
             length = self.stop_index - 1
             if self.current_index < length:
@@ -164,7 +217,39 @@ class PacketResult:
     __repr__ = __str__
 
 
+class PacketResultPool:
+    """
+    Free list of PacketResult objects. Results are reused after they've been handled
+    so a steady stream of packets allocates close to nothing per packet.
+    """
+    def __init__(self, max_size=256):
+        """
+        :param max_size: maximum number of free results to hold on to
+        """
+        self.max_size = max_size
+        self.free_results = []
+
+    def get(self, error_code, recv_time, packet_num) -> PacketResult:
+        """Return a reset result from the free list or a new one if the free list is empty"""
+        if len(self.free_results) == 0:
+            return PacketResult(error_code, recv_time, packet_num)
+        result = self.free_results.pop()
+        result.reset(error_code, recv_time, packet_num)
+        return result
+
+    def put(self, result: PacketResult):
+        """Return a handled result to the free list. Results that were kept are left alone"""
+        if result.is_kept or len(self.free_results) >= self.max_size:
+            return
+        self.free_results.append(result)
+
+    def __len__(self):
+        return len(self.free_results)
+
+
 class FuturePacketResult(PacketResult):
+    __slots__ = ("event",)
+
     def __init__(self, category):
         super().__init__(NULL_ERROR, 0, 0)
         self.category = category
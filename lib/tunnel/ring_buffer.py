@@ -0,0 +1,93 @@
+import threading
+
+
+class RingBuffer:
+    """
+    Fixed size byte buffer shared by a reader thread that fills it and a consumer that drains it.
+    The reader receives directly into the buffer's free space (socket.recv_into) so received bytes are
+    copied once, when the consumer reads them.
+
+    If high_water_mark bytes are waiting to be read, wait_for_space blocks the reader thread until the
+    consumer catches up. Bytes stay in the socket's receive buffer in the meantime and the sender slows down
+    instead of the buffer growing without bound.
+
+    Usage:
+    ring = RingBuffer(0x10000)
+    # reader thread
+    view = ring.wait_for_space(timeout)
+    if view is not None:
+        ring.commit(sock.recv_into(view))
+    # consumer
+    data = ring.read(len(ring))
+    """
+
+    def __init__(self, capacity=0x10000, high_water_mark=None):
+        """
+        :param capacity: size of the buffer in bytes
+        :param high_water_mark: number of unread bytes that blocks the reader. Defaults to capacity
+        """
+        self.capacity = capacity
+        self.high_water_mark = capacity if high_water_mark is None else min(high_water_mark, capacity)
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+
+        self.head = 0  # index of the first unread byte
+        self.size = 0  # number of unread bytes
+        self.condition = threading.Condition()
+
+    def get_free_length(self) -> int:
+        """Number of bytes that can be written after the last unread byte without wrapping around"""
+        tail = (self.head + self.size) % self.capacity
+        if self.size == self.capacity:
+            return 0
+        elif tail >= self.head:
+            return self.capacity - tail
+        else:
+            return self.head - tail
+
+    def wait_for_space(self, timeout=None):
+        """
+        Wait until fewer than high_water_mark bytes are unread. Called by the reader thread
+        :param timeout: maximum time to wait in seconds
+        :return: memoryview of free space to receive into or None if the timeout expired.
+            Call commit with the number of bytes written to it
+        """
+        with self.condition:
+            if not self.condition.wait_for(
+                    lambda: self.size < self.high_water_mark and self.get_free_length() > 0, timeout):
+                return None
+            tail = (self.head + self.size) % self.capacity
+            return self.view[tail:tail + self.get_free_length()]
+
+    def commit(self, num_bytes: int):
+        """Mark bytes written to the view returned by wait_for_space as unread"""
+        with self.condition:
+            self.size += num_bytes
+
+    def read(self, num_bytes: int) -> bytes:
+        """
+        Remove and return up to num_bytes unread bytes
+        :return: bytes, a single copy of the bytes even if they wrap around the end of the buffer
+        """
+        with self.condition:
+            num_bytes = min(num_bytes, self.size)
+            stop = self.head + num_bytes
+            if stop <= self.capacity:
+                data = bytes(self.view[self.head:stop])
+            else:
+                data = b"".join((self.view[self.head:], self.view[:stop - self.capacity]))
+            self.head = stop % self.capacity
+            self.size -= num_bytes
+            self.condition.notify_all()
+        return data
+
+    def clear(self):
+        """Drop all unread bytes"""
+        with self.condition:
+            # the reader may be writing into the free space. Only move the read position
+            self.head = (self.head + self.size) % self.capacity
+            self.size = 0
+            self.condition.notify_all()
+
+    def __len__(self):
+        return self.size
@@ -1,9 +1,11 @@
+import time
 import asyncio
 import warnings
 import serial
 import threading
 
 from ..client import TunnelBaseClient
+from ..ring_buffer import RingBuffer
 
 class TunnelSerialClient(TunnelBaseClient):
     """
@@ -15,6 +17,8 @@ class TunnelSerialClient(TunnelBaseClient):
         Call this after initialization to start serial connection
     flush():
         Flush serial buffer of all data
+    async wait():
+        Call this before update instead of sleeping. Returns when data arrives or a handshake is due
     async update():
         Call this in a loop to read all buffered data and run callbacks
     register_callback(category, callback):
@@ -28,12 +32,16 @@ class TunnelSerialClient(TunnelBaseClient):
         Override this method in a subclass. This gets called when any new correctly parsed packet arrives.
     stop():
         Gracefully shutdown the serial device connection
+
+    A reader thread receives from the device into a ring buffer and wakes up wait, so update never blocks
+    the event loop on the serial port.
     """
 
-    def __init__(self, address, baud, max_packet_len=128, debug=False):
+    def __init__(self, address, baud, max_packet_len=128, debug=False, buffer_size=0x4000):
         """
         :param address: path to arduino device. ex: "/dev/ttyACM0"
         :param baud: communication rate. Must match value defined on the arduino
+        :param buffer_size: size of the receive ring buffer in bytes
         """
         super().__init__(max_packet_len, debug)
 
@@ -45,16 +53,100 @@ class TunnelSerialClient(TunnelBaseClient):
         # a lock to prevent multiple sources from writing to the device at once
         self.write_lock = threading.Lock()
 
+        # the reader thread receives into this buffer. update reads from it
+        self.recv_buffer = RingBuffer(buffer_size)
+        self.read_thread = threading.Thread(target=self._read_task, daemon=True)
+        self.read_timeout = 0.1  # longest time a serial read blocks. The reader thread checks is_running this often
+        self.is_running = False
+
+        # set when data is received. Created in the event loop by start or wait
+        self.ready_event = None
+        self.loop = None
+
+        # longest time wait blocks if no data arrives and no handshakes are due
+        self.max_wait_time = 1.0
+
     def start(self):
         """Initializes the serial device"""
-        self.device = serial.Serial(self.address, self.baud)
+        self.device = serial.Serial(self.address, self.baud, timeout=self.read_timeout)
+        try:
+            self._set_loop(asyncio.get_running_loop())
+        except RuntimeError:
+            pass  # not started from the event loop. wait sets it
+        self.is_running = True
+        self.read_thread.start()
+
+    def _set_loop(self, loop):
+        self.loop = loop
+        self.ready_event = asyncio.Event()
+        if len(self.recv_buffer) > 0:
+            self.ready_event.set()
+
+    def _read_task(self):
+        while self.is_running:
+            view = self.recv_buffer.wait_for_space(self.read_timeout)
+            if view is None:
+                continue  # update hasn't caught up
+            try:
+                # read everything that's waiting or block until at least one byte arrives or read_timeout
+                num_bytes = self.device.in_waiting
+                num_bytes = self.device.readinto(view[:max(1, min(num_bytes, len(view)))])
+            except (serial.SerialException, OSError, TypeError) as e:
+                # TypeError is raised by pyserial if the port is closed while reading
+                if self.is_running:
+                    warnings.warn("Exception while reading %s: %s" % (self.address, e))
+                    self.is_running = False
+                break
+            if num_bytes == 0:
+                continue
+            self.recv_buffer.commit(num_bytes)
+            self._notify_ready()
+        self._notify_ready()
+
+    def _notify_ready(self):
+        """Wake up wait from the reader thread"""
+        if self.loop is None:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.ready_event.set)
+        except RuntimeError:
+            pass  # the event loop was closed
+
+    async def wait(self):
+        """
+        Wait until data arrives or a handshake is due. Call this before update instead of sleeping
+        """
+        if self.loop is None:
+            self._set_loop(asyncio.get_running_loop())
+        if self.ready_event.is_set():
+            return
+        timeout = self.max_wait_time
+        deadline = self.get_next_deadline()
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+        if timeout <= 0.0:
+            return
+        try:
+            await asyncio.wait_for(self.ready_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def update(self):
+        if self.ready_event is not None:
+            # data that arrives while parsing sets the event again
+            self.ready_event.clear()
+        return await super().update()
 
     def flush(self):
         """Flushes all unread characters on the buffer"""
-        self.device.flush()
+        self.device.reset_input_buffer()
+        self.recv_buffer.clear()
+
+    def available(self):
+        return len(self.recv_buffer)
 
     def _read(self, num_bytes):
-        return self.device.read(num_bytes)
+        return self.recv_buffer.read(num_bytes)
 
     def _write(self, packet):
         """Wrapper for device.write. Locks the device so multiple sources can't write at the same time"""
@@ -65,6 +157,10 @@ class TunnelSerialClient(TunnelBaseClient):
 
     def stop(self):
         """Gracefully shutdown the serial device connection"""
+        self.is_running = False
+        if self.read_thread.is_alive():
+            self.read_thread.join(timeout=1.0)
         self.device.close()
-        if len(self.buffer) > 0:
-            print("Device message:", self.buffer)
+        unparsed = self.decoder.get_unparsed()
+        if len(unparsed) > 0:
+            print("Device message:", unparsed)
@@ -0,0 +1,46 @@
+import os
+import tty
+import select
+
+
+class PtySerialDevice:
+    """
+    Stand-in for a serial device made from a pseudo-terminal. Open port with TunnelSerialClient like a real
+    device and write and read the device's side of the link with write and read. Linux and macOS only.
+
+    Usage:
+    device = PtySerialDevice()
+    tunnel = TunnelSerialClient(device.port, 115200)
+    tunnel.start()
+    device.write(protocol.make_packet("ping", "e", 0.0))
+    """
+
+    def __init__(self):
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)  # pass bytes through unchanged. No newline translation or echo
+        self.port = os.ttyname(self.slave_fd)
+
+    def write(self, data: bytes):
+        """Send bytes as if the device wrote them"""
+        view = memoryview(data)
+        while len(view) > 0:
+            num_bytes = os.write(self.master_fd, view)
+            view = view[num_bytes:]
+
+    def read(self, timeout=0.0) -> bytes:
+        """
+        Return bytes written to the device
+        :param timeout: time to wait for bytes in seconds
+        :return: bytes, empty if nothing was written before the timeout
+        """
+        readable, _, _ = select.select([self.master_fd], [], [], timeout)
+        if len(readable) == 0:
+            return b""
+        try:
+            return os.read(self.master_fd, 0x1000)
+        except OSError:
+            return b""  # the other side was closed
+
+    def close(self):
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
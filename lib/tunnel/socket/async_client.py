@@ -0,0 +1,205 @@
+import time
+import random
+import asyncio
+import warnings
+
+from lib.tunnel.util import *
+
+from ..client import TunnelBaseClient
+
+
+class TunnelAsyncSocketClient(TunnelBaseClient):
+    """
+    TunnelSocketClient built on asyncio.open_connection. Receives in a task on the event loop instead of
+    a thread, so many clients can run in one process. If the server can't be reached or closes the connection,
+    the client reconnects after a delay that doubles with each failed attempt (with jitter so many clients
+    don't reconnect in lockstep) and resets once a connection receives data. Connections the server closes
+    before sending anything count as failed attempts.
+
+    Usage is the same as TunnelSocketClient. The connection is opened by the first call to wait or update.
+    Call wait before update instead of sleeping
+    """
+
+    def __init__(self, address, port, max_packet_len=128, block_size=1024, timeout=5, debug=False):
+        """
+        :param address: server address
+        :param port: server port
+        :param block_size: maximum number of bytes read at once
+        :param timeout: seconds to wait for a connection to open
+        """
+        super().__init__(max_packet_len, debug)
+
+        # device properties
+        self.address = address
+        self.port = port
+        self.block_size = block_size
+        self.timeout = timeout
+
+        self.reader = None
+        self.writer = None
+        self.is_running = False
+        self.is_connected = False
+        self.connection_task = None
+
+        self.recv_buffer = bytearray()  # bytes received since the last update
+
+        # set when data is received or the connection opens or closes. Created in the event loop
+        self.ready_event = None
+
+        # reconnect delay doubles from min_reconnect_delay up to max_reconnect_delay.
+        # The delay is randomly scaled by up to reconnect_jitter in either direction
+        self.min_reconnect_delay = 0.1
+        self.max_reconnect_delay = 10.0
+        self.reconnect_jitter = 0.25
+        self.reconnect_attempts = 0  # failed attempts since a connection last received data
+
+        # longest time wait blocks if no data arrives and no handshakes are due
+        self.max_wait_time = 1.0
+
+    def start(self):
+        """The connection is opened by wait or update once the event loop is running"""
+        self.is_running = True
+
+    def _start_connection_task(self):
+        if self.ready_event is None:
+            self.ready_event = asyncio.Event()
+        self.connection_task = asyncio.ensure_future(self._connection_task())
+
+    def get_reconnect_delay(self):
+        """Time to wait before the next connection attempt"""
+        delay = min(self.max_reconnect_delay, self.min_reconnect_delay * 2 ** self.reconnect_attempts)
+        return delay * random.uniform(1.0 - self.reconnect_jitter, 1.0 + self.reconnect_jitter)
+
+    async def _connection_task(self):
+        while self.is_running:
+            try:
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.address, self.port), self.timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                delay = self.get_reconnect_delay()
+                self.reconnect_attempts += 1
+                if self.debug:
+                    print("Failed to connect to %s:%s (%s). Retrying in %0.2fs" % (self.address, self.port, e, delay))
+                await asyncio.sleep(delay)
+                continue
+
+            self.is_connected = True
+            if self.debug:
+                print("Opening new connection:", self.address)
+            self.ready_event.set()
+
+            # a server that accepts and closes right away counts as a failed attempt.
+            # The backoff only resets once the connection delivers data
+            if await self._receive_task():
+                self.reconnect_attempts = 0
+            else:
+                self.reconnect_attempts += 1
+
+            self.is_connected = False
+            self._close_writer()
+            # a partial packet from the closed connection will never be completed. Drop unread bytes too
+            # so they aren't parsed ahead of the next connection's data
+            self.recv_buffer.clear()
+            self.decoder.clear()
+            self.ready_event.set()
+            if self.is_running:
+                await asyncio.sleep(self.get_reconnect_delay())
+
+    async def _receive_task(self) -> bool:
+        """
+        Read from the connection until the server closes it
+        :return: whether any data was received
+        """
+        received = False
+        while self.is_running:
+            try:
+                content = await self.reader.read(self.block_size)
+            except OSError as e:
+                warnings.warn("Exception while reading %s: %s" % (self.address, e))
+                return received
+            if len(content) == 0:
+                # the server closed its side of the connection. Nothing more will be received
+                if self.debug:
+                    print("Connection closed by", self.address)
+                return received
+            received = True
+            self.recv_buffer += content
+            self.ready_event.set()
+        return received
+
+    def _close_writer(self):
+        if self.writer is None:
+            return
+        writer = self.writer
+        self.writer = None
+        try:
+            if not writer.is_closing() and writer.can_write_eof():
+                # tell the server this side is done sending before closing
+                writer.write_eof()
+            writer.close()
+        except OSError:
+            pass
+
+    async def wait(self):
+        """
+        Wait until data arrives, the connection opens or closes, or a handshake is due.
+        Call this before update instead of sleeping
+        """
+        if self.connection_task is None and self.is_running:
+            self._start_connection_task()
+        if self.ready_event is None:
+            self.ready_event = asyncio.Event()
+        if self.ready_event.is_set():
+            return
+        timeout = self.max_wait_time
+        deadline = self.get_next_deadline()
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+        if timeout <= 0.0:
+            return
+        try:
+            await asyncio.wait_for(self.ready_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def update(self):
+        if self.connection_task is None and self.is_running:
+            self._start_connection_task()
+        if self.ready_event is not None:
+            # data that arrives while parsing sets the event again
+            self.ready_event.clear()
+        return await super().update()
+
+    def flush(self):
+        """Flushes all unread characters on the buffer"""
+        self.recv_buffer.clear()
+
+    def available(self):
+        return len(self.recv_buffer)
+
+    def _read(self, num_bytes):
+        """Reads requested number of bytes (or less) from the received buffer"""
+        content = bytes(self.recv_buffer[:num_bytes])
+        del self.recv_buffer[:num_bytes]
+        return content
+
+    def _write(self, packet):
+        """Buffer the packet in the connection's transport. Never blocks. Packets are dropped while disconnected"""
+        if not self.is_connected or self.writer is None or self.writer.is_closing():
+            if self.debug:
+                print("Not connected. Dropping packet:", packet)
+            return
+        self.writer.write(packet)
+        if self.debug:
+            print("Writing:", packet)
+
+    def stop(self):
+        """Gracefully shutdown the device connection"""
+        self.is_running = False
+        self.is_connected = False
+        self._close_writer()
+        if self.connection_task is not None:
+            self.connection_task.cancel()
+        unparsed = self.decoder.get_unparsed()
+        if len(unparsed) > 0:
+            print("Device message:", unparsed)
@@ -0,0 +1,95 @@
+import asyncio
+
+from lib.tunnel.util import *
+
+from .server import TunnelSocketFactory
+
+
+class TunnelServerProtocol(asyncio.Protocol):
+    """asyncio protocol for one device connection. Passes received bytes to the connection's tunnel"""
+
+    def __init__(self, factory):
+        """
+        :param factory: TunnelAsyncSocketFactory that creates a tunnel for the connection
+        """
+        self.factory = factory
+        self.tunnel = None
+
+    def connection_made(self, transport):
+        self.tunnel = self.factory.add_tunnel(transport)
+
+    def data_received(self, data):
+        self.tunnel.receive(data)
+
+    def connection_lost(self, exc):
+        if self.tunnel.is_running:
+            self.tunnel.stop()
+        self.factory.notify_ready()
+
+
+class TunnelAsyncSocketFactory(TunnelSocketFactory):
+    """
+    TunnelSocketFactory that accepts devices with the event loop's server (loop.create_server)
+    instead of an accept thread. Each connection gets a TunnelServerProtocol that feeds received bytes into
+    a tunnel_client_class instance as soon as they arrive. Reads and writes never block the loop.
+
+    Usage is the same as TunnelSocketFactory. The server starts listening on the first call to wait or update
+    """
+
+    def __init__(self, tunnel_client_class, address, port, max_packet_len=128, block_size=1024, debug=False, **kwargs):
+        super().__init__(tunnel_client_class, address, port, max_packet_len, block_size, debug, **kwargs)
+        self.server = None
+
+        # if a device doesn't send anything for this long, its connection is closed
+        self.recv_timeout = 10.0
+
+        # if True, other processes may listen on the same port. The kernel spreads connections between them
+        self.reuse_port = False
+
+    async def start_server(self):
+        """Start listening for device connections"""
+        self._loop = asyncio.get_running_loop()
+        if self.ready_event is None:
+            self.ready_event = asyncio.Event()
+        self.server = await self._loop.create_server(
+            lambda: TunnelServerProtocol(self), self.address, self.port, reuse_address=True,
+            reuse_port=self.reuse_port or None
+        )
+        if self.debug:
+            print("Listening on %s:%s" % (self.address, self.port))
+
+    def start(self):
+        """The server is started by wait or update once the event loop is running"""
+
+    def add_tunnel(self, transport):
+        """Create a tunnel for a new connection. Called by TunnelServerProtocol"""
+        address = transport.get_extra_info("peername")
+        tunnel = self.tunnel_client_class(transport, address, self.max_packet_len, self.block_size, self.debug, **self.client_class_kwargs)
+        tunnel.ready_event = self.ready_event
+        tunnel.index = self.index
+        tunnel.start()
+        tunnel.recv_timeout = self.recv_timeout
+        self.tunnels.append(tunnel)
+        self.notify_ready()
+        return tunnel
+
+    def notify_ready(self):
+        """Wake up wait. Called from the event loop"""
+        if self.ready_event is not None:
+            self.ready_event.set()
+
+    async def wait(self):
+        if self.server is None:
+            await self.start_server()
+        await super().wait()
+
+    async def update(self):
+        if self.server is None:
+            await self.start_server()
+        return await super().update()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
+        for tunnel in self.tunnels:
+            tunnel.stop()
@@ -7,10 +7,17 @@ from queue import Queue
 from lib.tunnel.util import *
 
 from ..client import TunnelBaseClient
+from ..ring_buffer import RingBuffer
 
 
 class TunnelSocketClient(TunnelBaseClient):
-    def __init__(self, address, port, max_packet_len=128, block_size=1024, timeout=5, debug=False):
+    def __init__(self, address, port, max_packet_len=128, block_size=1024, timeout=5, debug=False,
+                 buffer_size=0x10000, high_water_mark=None):
+        """
+        :param buffer_size: size of the receive ring buffer in bytes
+        :param high_water_mark: if this many received bytes haven't been read by update, the socket thread
+            stops receiving until they are. Defaults to buffer_size
+        """
         super().__init__(max_packet_len, debug)
 
         # device properties
@@ -26,8 +33,8 @@ class TunnelSocketClient(TunnelBaseClient):
 
         self.sock = None
 
-        self.socket_buffer = b""
-        self.read_lock = threading.Lock()
+        # the socket thread receives directly into this buffer. update reads from it
+        self.socket_buffer = RingBuffer(buffer_size, high_water_mark)
         self.write_lock = threading.Lock()
 
     def _socket_client_task(self):
@@ -46,11 +53,14 @@ class TunnelSocketClient(TunnelBaseClient):
             while True:
                 if not self.socket_run_flag:
                     break
-                content = self.sock.recv(self.block_size)
-                if len(content) == 0:
+                # blocks while the buffer is at its high water mark
+                view = self.socket_buffer.wait_for_space(0.1)
+                if view is None:
+                    continue
+                num_bytes = self.sock.recv_into(view, min(len(view), self.block_size))
+                if num_bytes == 0:
                     break
-                with self.read_lock:
-                    self.socket_buffer += content
+                self.socket_buffer.commit(num_bytes)
         self.sock.close()
 
     def start(self):
@@ -59,19 +69,14 @@ class TunnelSocketClient(TunnelBaseClient):
 
     def flush(self):
         """Flushes all unread characters on the buffer"""
-        with self.read_lock:
-            self.socket_buffer = b""
+        self.socket_buffer.clear()
 
     def available(self):
-        return self.block_size
+        return len(self.socket_buffer)
 
     def _read(self, num_bytes):
         """Reads requested number of bytes (or less) from device"""
-        read_len = min(num_bytes, len(self.socket_buffer))
-        with self.read_lock:
-            read_bytes = self.socket_buffer[0:read_len]
-            self.socket_buffer = self.socket_buffer[read_len:]
-            return read_bytes
+        return self.socket_buffer.read(num_bytes)
 
     def _write(self, packet):
         """Wrapper for device.write. Locks the device so multiple sources can't write at the same time"""
@@ -87,5 +92,6 @@ class TunnelSocketClient(TunnelBaseClient):
     def stop(self):
         """Gracefully shutdown the device connection"""
         self.socket_run_flag = False
-        if len(self.buffer) > 0:
-            print("Device message:", self.buffer)
+        unparsed = self.decoder.get_unparsed()
+        if len(unparsed) > 0:
+            print("Device message:", unparsed)
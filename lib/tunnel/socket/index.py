@@ -0,0 +1,69 @@
+class TunnelIndex:
+    """
+    Tunnels of a factory indexed by the device ID and type they report. Tunnels add themselves with update
+    once the device identifies itself and the factory removes them when they disconnect, so finding a
+    device or iterating devices of one type doesn't scan every connection.
+
+    If a second tunnel reports an ID that's already indexed, the device reconnected (after a reboot or a
+    Wi-Fi roam) and the older tunnel is stopped right away instead of waiting for it to time out.
+    If evict_duplicates is False, both stay open and get returns the one that reported the ID last
+    """
+
+    def __init__(self):
+        self.by_id = {}  # {device_id: tunnel}
+        self.by_type = {}  # {device_type: {tunnel: None, ...}} dictionaries keep connection order
+        self.keys = {}  # {tunnel: (device_id, device_type)}
+        self.evict_duplicates = True
+
+    def update(self, tunnel, device_id, device_type):
+        """
+        Index a tunnel under a new ID and type
+        :return: the tunnel that had the ID before if it was evicted, otherwise None
+        """
+        self.remove(tunnel)
+        evicted = None
+        previous = self.by_id.get(device_id)
+        if self.evict_duplicates and previous is not None and previous is not tunnel:
+            self.remove(previous)
+            previous.stop()
+            evicted = previous
+        self.by_id[device_id] = tunnel
+        if device_type not in self.by_type:
+            self.by_type[device_type] = {}
+        self.by_type[device_type][tunnel] = None
+        self.keys[tunnel] = (device_id, device_type)
+        return evicted
+
+    def remove(self, tunnel):
+        """Remove a tunnel from the index. Does nothing if the tunnel isn't indexed"""
+        key = self.keys.pop(tunnel, None)
+        if key is None:
+            return
+        device_id, device_type = key
+        if self.by_id.get(device_id) is tunnel:
+            del self.by_id[device_id]
+        tunnels = self.by_type[device_type]
+        del tunnels[tunnel]
+        if len(tunnels) == 0:
+            del self.by_type[device_type]
+
+    def get(self, device_id):
+        """Return the tunnel of a device ID or None if no connected device has it"""
+        return self.by_id.get(device_id)
+
+    def iter_type(self, device_type):
+        """Iterate over the tunnels of a device type"""
+        # copied so tunnels may be removed while iterating
+        for tunnel in list(self.by_type.get(device_type, ())):
+            yield tunnel
+
+    def clear(self):
+        self.by_id.clear()
+        self.by_type.clear()
+        self.keys.clear()
+
+    def __contains__(self, tunnel):
+        return tunnel in self.keys
+
+    def __len__(self):
+        return len(self.keys)
@@ -0,0 +1,249 @@
+import socket
+import asyncio
+import warnings
+import selectors
+import threading
+from collections import deque
+
+from lib.tunnel.util import *
+
+from .async_server import TunnelAsyncSocketFactory
+
+
+class SelectorConnection(asyncio.Transport):
+    """
+    One device connection owned by TunnelSelectorSocketFactory's I/O thread. Acts as the tunnel's transport:
+    write sends what it can right away and leaves the rest for the I/O thread.
+    """
+
+    def __init__(self, factory, sock: socket.socket, address, block_size: int):
+        super().__init__()
+        self.factory = factory
+        self.sock = sock
+        self.address = address
+        self.tunnel = None  # created in the event loop once the connection is announced
+
+        # recv_into target. Reused for every read of this connection
+        self.recv_buffer = bytearray(block_size)
+        self.recv_view = memoryview(self.recv_buffer)
+
+        self.write_buffer = bytearray()  # bytes the socket didn't accept yet
+        self.write_lock = threading.Lock()
+        self.closing = False
+
+    def write(self, data):
+        """Send data without blocking. Called from the event loop"""
+        if self.closing:
+            return
+        with self.write_lock:
+            if len(self.write_buffer) == 0:
+                try:
+                    sent = self.sock.send(data)
+                except (BlockingIOError, InterruptedError):
+                    sent = 0
+                except OSError as e:
+                    warnings.warn("Failed to write to %s: %s" % (str(self.address), e))
+                    self.close()
+                    return
+                if sent == len(data):
+                    return
+                data = memoryview(data)[sent:]
+            self.write_buffer += data
+        self.factory.request(self.factory.WRITE_COMMAND, self)
+
+    def flush_write_buffer(self, batch: list) -> bool:
+        """
+        Send buffered bytes. Called from the I/O thread when the socket is writable
+        :param batch: the I/O thread's batch. The connection's close is added to it if sending fails
+        :return: True if the write buffer is empty or the connection was closed
+        """
+        with self.write_lock:
+            try:
+                sent = self.sock.send(self.write_buffer)
+            except (BlockingIOError, InterruptedError):
+                return False
+            except OSError as e:
+                # the device reset the connection. Close it without stopping the I/O thread
+                warnings.warn("Failed to write to %s: %s" % (str(self.address), e))
+                self.write_buffer.clear()
+                self.factory._close(self)
+                batch.append((self, None))
+                return True
+            del self.write_buffer[:sent]
+            return len(self.write_buffer) == 0
+
+    def close(self):
+        if self.closing:
+            return
+        self.closing = True
+        self.factory.request(self.factory.CLOSE_COMMAND, self)
+
+    def abort(self):
+        """Close without sending buffered bytes"""
+        with self.write_lock:
+            self.write_buffer.clear()
+        self.close()
+
+    def get_write_buffer_size(self):
+        return len(self.write_buffer)
+
+    def is_closing(self):
+        return self.closing
+
+    def get_extra_info(self, name, default=None):
+        if name == "peername":
+            return self.address
+        elif name == "socket":
+            return self.sock
+        else:
+            return default
+
+
+class TunnelSelectorSocketFactory(TunnelAsyncSocketFactory):
+    """
+    TunnelSocketFactory for many device connections. One I/O thread waits on all sockets with a
+    selectors.DefaultSelector (epoll on Linux), accepts new devices, and reads every ready socket with
+    recv_into into the connection's buffer. Everything read in one select round is passed to the event loop
+    in a single batch, so the loop wakes up once per round instead of once per socket.
+
+    Usage is the same as TunnelSocketFactory. The I/O thread starts on the first call to wait or update
+    """
+
+    # commands sent from the event loop to the I/O thread
+    WRITE_COMMAND = 0
+    CLOSE_COMMAND = 1
+
+    def __init__(self, tunnel_client_class, address, port, max_packet_len=128, block_size=1024, debug=False, **kwargs):
+        super().__init__(tunnel_client_class, address, port, max_packet_len, block_size, debug, **kwargs)
+        self.selector = None
+        self._io_thread = None
+        self._commands = deque()  # (command, SelectorConnection) for the I/O thread
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()  # interrupts select when commands are queued
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self.select_timeout = 0.5
+
+    async def start_server(self):
+        """Start the I/O thread"""
+        self._loop = asyncio.get_running_loop()
+        if self.ready_event is None:
+            self.ready_event = asyncio.Event()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.address, self.port))
+        sock.listen(socket.SOMAXCONN)
+        sock.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(sock, selectors.EVENT_READ, None)
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ, self._wakeup_recv)
+        self.server = sock
+        self._io_thread = threading.Thread(target=self._io_task, daemon=True)
+        self._io_thread.start()
+        if self.debug:
+            print("Listening on %s:%s with %s" % (self.address, self.port, self.selector.__class__.__name__))
+
+    def request(self, command: int, connection: SelectorConnection):
+        """Queue a command for the I/O thread and wake it up"""
+        self._commands.append((command, connection))
+        try:
+            self._wakeup_send.send(b"\0")
+        except (BlockingIOError, InterruptedError):
+            pass  # the I/O thread already has wake up bytes to read
+
+    def _io_task(self):
+        batch = []
+        while self._task_flag:
+            for key, mask in self.selector.select(self.select_timeout):
+                if key.data is None:
+                    self._accept(key.fileobj, batch)
+                elif key.data is self._wakeup_recv:
+                    self._run_commands()
+                else:
+                    connection = key.data
+                    if mask & selectors.EVENT_READ:
+                        self._read(connection, batch)
+                    if mask & selectors.EVENT_WRITE and not connection.closing:
+                        if connection.flush_write_buffer(batch) and not connection.closing:
+                            self.selector.modify(connection.sock, selectors.EVENT_READ, connection)
+            if len(batch) > 0:
+                self._loop.call_soon_threadsafe(self._receive_batch, batch)
+                batch = []
+        self.selector.close()
+
+    def _accept(self, sock: socket.socket, batch: list):
+        while True:
+            try:
+                client, address = sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                warnings.warn("%s: %s" % (type(e), e))
+                return
+            client.setblocking(False)
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = SelectorConnection(self, client, address, self.block_size)
+            self.selector.register(client, selectors.EVENT_READ, connection)
+            batch.append((connection, b""))
+
+    def _read(self, connection: SelectorConnection, batch: list):
+        try:
+            num_bytes = connection.sock.recv_into(connection.recv_buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            num_bytes = 0
+        if num_bytes == 0:
+            # closed by the device
+            self._close(connection)
+            batch.append((connection, None))
+        else:
+            batch.append((connection, bytes(connection.recv_view[:num_bytes])))
+
+    def _run_commands(self):
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while len(self._commands) > 0:
+            command, connection = self._commands.popleft()
+            if connection.sock.fileno() == -1:
+                continue  # already closed
+            if command == self.WRITE_COMMAND and not connection.closing:
+                self.selector.modify(connection.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, connection)
+            elif command == self.CLOSE_COMMAND:
+                self._close(connection)
+
+    def _close(self, connection: SelectorConnection):
+        connection.closing = True
+        if connection.sock.fileno() == -1:
+            return
+        self.selector.unregister(connection.sock)
+        connection.sock.close()
+
+    def _receive_batch(self, batch: list):
+        """Pass bytes read in one select round to the tunnels. Runs in the event loop"""
+        for connection, data in batch:
+            if connection.tunnel is None:
+                connection.tunnel = self.add_tunnel(connection)
+            if data is None:
+                if connection.tunnel.is_running:
+                    connection.tunnel.stop()
+                self.notify_ready()
+            elif len(data) > 0:
+                connection.tunnel.receive(data)
+
+    def stop(self):
+        self._task_flag = False
+        for tunnel in self.tunnels:
+            tunnel.stop()
+        if self._io_thread is not None:
+            try:
+                self._wakeup_send.send(b"\0")
+            except OSError:
+                pass
+            self._io_thread.join(timeout=1.0)
+        if self.server is not None:
+            self.server.close()
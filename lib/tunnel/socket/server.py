@@ -1,5 +1,6 @@
 import socket
 import time
+import asyncio
 import warnings
 import threading
 from queue import Queue
@@ -7,6 +8,7 @@ from queue import Queue
 from lib.tunnel.util import *
 
 from ..client import TunnelBaseClient
+from .index import TunnelIndex
 
 
 class TunnelSocketFactory:
@@ -24,6 +26,17 @@ class TunnelSocketFactory:
         self._clients_queue = Queue()
 
         self.tunnels = []
+        self.index = TunnelIndex()  # tunnels by the device ID and type they report
+
+        # set when a tunnel receives data or a client connects. Created in the event loop by wait
+        self.ready_event = None
+        self._loop = None
+
+        # longest time wait blocks if no data arrives and no handshakes are due
+        self.max_wait_time = 1.0
+
+        # if not None, tunnels idle for longer than this (see TunnelSocketServer.get_idle_time) are closed
+        self.idle_timeout = None
 
     def _socket_task(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -46,29 +59,81 @@ class TunnelSocketFactory:
                 continue
             client.settimeout(10.0)
             self._clients_queue.put((client, address))
+            self._notify_ready()
+
+    def _notify_ready(self):
+        """Wake up wait from the accept thread"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self.ready_event.set)
 
     def iter_tunnels(self):
         for tunnel in self.tunnels:
             yield tunnel
 
+    def get_tunnel(self, device_id):
+        """Return the tunnel of a connected device by its ID or None if it isn't connected"""
+        return self.index.get(device_id)
+
+    def iter_tunnels_of_type(self, device_type):
+        """Iterate over the tunnels of connected devices that reported a type"""
+        return self.index.iter_type(device_type)
+
     def start(self):
         self._socket_thread.start()
     
     def _check_clients(self):
-        delete_indices = []
-        for index, tunnel in enumerate(self.tunnels):
-            if not tunnel.is_running:
-                delete_indices.append(index)
-            for index in delete_indices[::-1]:
-                self.tunnels.pop(index)
+        if self.idle_timeout is not None:
+            self._reap_idle_tunnels()
+        if not all([tunnel.is_running for tunnel in self.tunnels]):
+            self.tunnels = [tunnel for tunnel in self.tunnels if tunnel.is_running]
         
         while not self._clients_queue.empty():
             client, address = self._clients_queue.get()
             tunnel = self.tunnel_client_class(client, address, self.max_packet_len, self.block_size, self.debug, **self.client_class_kwargs)
+            tunnel.ready_event = self.ready_event
+            tunnel.index = self.index
             tunnel.start()
             self.tunnels.append(tunnel)
     
+    def _reap_idle_tunnels(self):
+        for tunnel in self.tunnels:
+            if not tunnel.is_running:
+                continue
+            idle_time = tunnel.get_idle_time()
+            if idle_time > self.idle_timeout:
+                print("%s idle for %0.1fs. Closing" % (str(tunnel.address), idle_time))
+                tunnel.stop()
+
+    async def wait(self):
+        """
+        Wait until a tunnel receives data, a client connects, or a tunnel has a handshake due.
+        Call this before update instead of sleeping
+        """
+        if self.ready_event is None:
+            self.ready_event = asyncio.Event()
+            self._loop = asyncio.get_event_loop()
+            for tunnel in self.tunnels:
+                tunnel.ready_event = self.ready_event
+        if self.ready_event.is_set() or not self._clients_queue.empty():
+            return
+
+        timeout = self.max_wait_time
+        current_time = time.time()
+        for tunnel in self.tunnels:
+            deadline = tunnel.get_next_deadline()
+            if deadline is not None:
+                timeout = min(timeout, deadline - current_time)
+        if timeout <= 0.0:
+            return
+        try:
+            await asyncio.wait_for(self.ready_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
     async def update(self):
+        if self.ready_event is not None:
+            # data that arrives while tunnels are being updated sets the event again
+            self.ready_event.clear()
         self._check_clients()
         all_results = []
         for tunnel in self.tunnels:
@@ -77,8 +142,23 @@ class TunnelSocketFactory:
         return all_results
     
     def write(self, category, formats, *args):
+        """
+        Write a packet to every tunnel. The packet is encoded once and each tunnel only fills in
+        its packet count and checksum
+        """
+        template = None
         for tunnel in self.tunnels:
-            tunnel.write(category, formats, *args)
+            if not tunnel.is_running:
+                continue
+            if template is None:
+                template = tunnel.protocol.make_packet_template(category, formats, *args)
+            tunnel.write_template(template)
+
+    def write_many(self, messages):
+        """Write many packets to every tunnel. Each tunnel receives all of them in a single write"""
+        messages = list(messages)
+        for tunnel in self.tunnels:
+            tunnel.write_many(messages)
     
     def stop(self):
         self._task_flag = False
@@ -97,17 +177,115 @@ class TunnelSocketServer(TunnelBaseClient):
 
         self.is_running = False
 
+        # If not None, set when data is received. TunnelSocketFactory shares one event among all tunnels
+        self.ready_event = None
+
+        # If not None, the factory's TunnelIndex. Call set_device_id when the device identifies itself
+        self.index = None
+
+        # When the event loop supports reader callbacks, the socket is read as soon as data arrives
+        # and bytes are stored here until update is called. Otherwise, _read blocks on the socket.
+        # If socket_client is an asyncio transport, TunnelAsyncSocketFactory passes received bytes to receive
+        self.loop = None
+        self.transport = None
+        self.recv_buffer = bytearray()
+        self.recv_timeout = None  # if no data is received for this long, the connection is closed
+        self.prev_recv_time = time.time()
+
+        # bytes the socket didn't accept yet. Sent when the event loop reports the socket is writable
+        self.pending_writes = bytearray()
+
+        # If more than this many bytes are waiting to be sent, the device stopped reading and the connection
+        # is closed. Applies to pending_writes and the transport's write buffer. If less than or equal to 0,
+        # there's no limit
+        self.max_pending_writes = 16 * block_size
+
     def start(self):
         """Initializes the socket device"""
         self.is_running = True
+        if isinstance(self.socket_client, asyncio.BaseTransport):
+            self.transport = self.socket_client
+            self.loop = asyncio.get_running_loop()
+            self.prev_recv_time = time.time()
+            return
+        self.recv_timeout = self.socket_client.gettimeout()
+        try:
+            loop = asyncio.get_running_loop()
+            self.socket_client.setblocking(False)
+            loop.add_reader(self.socket_client.fileno(), self._on_readable)
+        except (NotImplementedError, RuntimeError, OSError) as e:
+            # event loop doesn't support reader callbacks. Fall back to blocking reads
+            if self.debug:
+                print("Reading %s with blocking reads: %s" % (str(self.address), e))
+            self.socket_client.settimeout(self.recv_timeout)
+            return
+        self.loop = loop
+        self.prev_recv_time = time.time()
+
+    def _on_readable(self):
+        """Called by the event loop when the socket has data"""
+        try:
+            content = self.socket_client.recv(self.block_size)
+        except BlockingIOError:
+            return
+        except BaseException as e:
+            print("Exception while attempting to read %s: %s" % (str(self.address), e))
+            self.stop()
+            content = b""
+        if len(content) == 0:
+            self.stop()  # the socket was closed
+            if self.ready_event is not None:
+                self.ready_event.set()
+        else:
+            self.receive(content)
+
+    def receive(self, content: bytes):
+        """Store bytes received from the device until update is called"""
+        self.recv_buffer += content
+        self.prev_recv_time = time.time()
+        if self.ready_event is not None:
+            self.ready_event.set()
+
+    def set_device_id(self, device_id, device_type):
+        """
+        Index this tunnel in its factory under the ID and type the device reported
+        :return: the older tunnel of the same device if it was evicted, otherwise None
+        """
+        if self.index is not None and self.is_running:
+            return self.index.update(self, device_id, device_type)
+        return None
+
+    def get_idle_time(self):
+        """Seconds since the device last sent anything. Used by TunnelSocketFactory.idle_timeout"""
+        return time.time() - self.prev_recv_time
 
     def flush(self):
         """Flushes all unread characters on the buffer"""
+        self.recv_buffer.clear()
 
     def available(self):
-        return self.block_size
+        if self.loop is None:
+            return self.block_size
+        if len(self.recv_buffer) == 0 and self.is_running and self.recv_timeout is not None:
+            if time.time() - self.prev_recv_time > self.recv_timeout:
+                print("%s timeout" % str(self.address))
+                self.stop()
+        return len(self.recv_buffer)
+
+    def get_next_deadline(self):
+        deadline = super().get_next_deadline()
+        if self.loop is None or self.recv_timeout is None:
+            return deadline
+        timeout_deadline = self.prev_recv_time + self.recv_timeout
+        if deadline is None:
+            return timeout_deadline
+        return min(deadline, timeout_deadline)
 
     def _read(self, num_bytes):
+        if self.loop is not None:
+            content = bytes(self.recv_buffer[:num_bytes])
+            del self.recv_buffer[:num_bytes]
+            return content
         if not self.is_running:
             return b""
         try:
@@ -129,11 +307,73 @@ class TunnelSocketServer(TunnelBaseClient):
     def _write(self, packet):
         if not self.is_running:
             return
+        if self.transport is not None:
+            self.transport.write(packet)  # buffered by the transport. Never blocks
+            if self.debug:
+                print("Writing:", packet)
+            self._check_pending_writes(self.transport.get_write_buffer_size())
+            return
+        if self.loop is not None:
+            self._send_nonblocking(packet)
+            return
         try:
             self.socket_client.sendall(packet)
         except BaseException as e:
             print("Failed to write packet:", e)
             self.stop()
 
+    def _send_nonblocking(self, packet):
+        """Send what the socket accepts now and leave the rest for _on_writable"""
+        if len(self.pending_writes) > 0:
+            self.pending_writes += packet  # keep packets in order
+            self._check_pending_writes(len(self.pending_writes))
+            return
+        try:
+            sent = self.socket_client.send(packet)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except BaseException as e:
+            print("Failed to write packet:", e)
+            self.stop()
+            return
+        if sent < len(packet):
+            self.pending_writes += memoryview(packet)[sent:]
+            self.loop.add_writer(self.socket_client.fileno(), self._on_writable)
+            self._check_pending_writes(len(self.pending_writes))
+
+    def _check_pending_writes(self, num_bytes):
+        """Close the connection if the device isn't reading what's written to it"""
+        if 0 < self.max_pending_writes < num_bytes:
+            print("%s has %s unsent bytes. Closing" % (str(self.address), num_bytes))
+            if self.transport is not None:
+                self.transport.abort()  # close would wait for the buffered bytes to be sent
+            self.stop()
+
+    def _on_writable(self):
+        """Called by the event loop when the socket can accept more bytes"""
+        try:
+            sent = self.socket_client.send(self.pending_writes)
+        except (BlockingIOError, InterruptedError):
+            return
+        except BaseException as e:
+            print("Failed to write packet:", e)
+            self.stop()
+            return
+        del self.pending_writes[:sent]
+        if len(self.pending_writes) == 0:
+            self.loop.remove_writer(self.socket_client.fileno())
+
     def stop(self):
+        if self.index is not None:
+            self.index.remove(self)
+        if self.is_running:
+            if self.transport is not None:
+                self.transport.close()
+            elif self.socket_client.fileno() != -1:
+                if self.loop is not None:
+                    self.loop.remove_reader(self.socket_client.fileno())
+                    self.loop.remove_writer(self.socket_client.fileno())
+                    self.pending_writes.clear()
+                # closing lets the device see the disconnect and reconnect
+                self.socket_client.close()
         self.is_running = False
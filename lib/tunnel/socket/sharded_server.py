@@ -0,0 +1,378 @@
+import os
+import time
+import pickle
+import signal
+import socket
+import struct
+import asyncio
+import warnings
+import multiprocessing
+
+from lib.tunnel.util import *
+
+from .index import TunnelIndex
+from .async_server import TunnelAsyncSocketFactory
+
+# first byte of each message a shard worker sends to the coordinator
+SHARD_STATE_MESSAGE = b"S"  # followed by packed state records of every connected tunnel
+SHARD_OPEN_MESSAGE = b"O"  # followed by pickled (key, address) of a new tunnel
+SHARD_CLOSE_MESSAGE = b"C"  # followed by pickled key of a stopped tunnel
+
+
+def get_shard_record_struct(tunnel_client_class) -> struct.Struct:
+    """
+    State records are the tunnel's key followed by the values of tunnel_client_class.get_shared_state
+    packed with tunnel_client_class.shared_state_format (a struct format without a byte order character)
+    """
+    return struct.Struct("<I" + tunnel_client_class.shared_state_format)
+
+
+class TunnelShardWorker:
+    """
+    Runs in a shard worker process. Accepts and parses its share of the device connections with a
+    TunnelAsyncSocketFactory bound with SO_REUSEPORT, publishes the state of its tunnels to the coordinator
+    every publish_interval seconds, and runs commands the coordinator sends to its tunnels.
+    """
+
+    def __init__(self, connection, tunnel_client_class, address, port, max_packet_len, block_size, debug,
+                 publish_interval, idle_timeout, **kwargs):
+        """
+        :param connection: multiprocessing Connection to the coordinator
+        :param publish_interval: seconds between state messages
+        :param idle_timeout: TunnelSocketFactory.idle_timeout of the worker's factory
+        """
+        self.connection = connection
+        self.factory = TunnelAsyncSocketFactory(
+            tunnel_client_class, address, port, max_packet_len, block_size, debug, **kwargs)
+        self.factory.reuse_port = True
+        self.factory.max_wait_time = publish_interval
+        self.factory.idle_timeout = idle_timeout
+        self.publish_interval = publish_interval
+        self.record_struct = get_shard_record_struct(tunnel_client_class)
+
+        self.published = {}  # {key: tunnel} tunnels the coordinator knows about
+        self.keys = {}  # {id(tunnel): key}
+        self.next_key = 0
+        self.next_publish_time = 0.0
+        self.is_running = False
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.connection.fileno(), self.on_command)
+        self.is_running = True
+        try:
+            while self.is_running:
+                await self.factory.wait()
+                await self.factory.update()
+                if time.monotonic() >= self.next_publish_time:
+                    self.publish()
+        finally:
+            loop.remove_reader(self.connection.fileno())
+            self.factory.stop()
+
+    def on_command(self):
+        """Run commands sent by the coordinator. Called by the event loop when the connection has data"""
+        try:
+            while self.connection.poll():
+                key, name, args = self.connection.recv()
+                if key is None:
+                    getattr(self.factory, name)(*args)  # broadcast to every tunnel of this worker
+                    continue
+                tunnel = self.published.get(key)
+                if tunnel is not None and tunnel.is_running:  # may have closed before the command arrived
+                    getattr(tunnel, name)(*args)
+        except (EOFError, OSError):
+            self.is_running = False  # the coordinator stopped
+        # handshakes may have been added. Let wait recompute its deadline
+        self.factory.notify_ready()
+
+    def publish(self):
+        """Send the coordinator new and stopped tunnels and the state of every running tunnel"""
+        self.next_publish_time = time.monotonic() + self.publish_interval
+        try:
+            for key, tunnel in list(self.published.items()):
+                if not tunnel.is_running:
+                    self.connection.send_bytes(SHARD_CLOSE_MESSAGE + pickle.dumps(key))
+                    del self.published[key]
+                    del self.keys[id(tunnel)]
+
+            records = [SHARD_STATE_MESSAGE]
+            for tunnel in self.factory.tunnels:
+                if not tunnel.is_running:
+                    continue
+                key = self.keys.get(id(tunnel))
+                if key is None:
+                    key = self.next_key
+                    self.next_key += 1
+                    self.keys[id(tunnel)] = key
+                    self.published[key] = tunnel
+                    self.connection.send_bytes(SHARD_OPEN_MESSAGE + pickle.dumps((key, tunnel.address)))
+                try:
+                    records.append(self.record_struct.pack(key, *tunnel.get_shared_state()))
+                except struct.error as e:
+                    # a value doesn't fit its format. Skip this tunnel instead of the whole message
+                    warnings.warn("Failed to publish the state of %s: %s" % (str(tunnel.address), e))
+            self.connection.send_bytes(b"".join(records))
+        except OSError:
+            self.is_running = False
+
+
+def run_shard_worker(connection, tunnel_client_class, address, port, max_packet_len, block_size, debug,
+                     publish_interval, idle_timeout, kwargs):
+    """Entry point of a shard worker process"""
+    # the coordinator handles Ctrl-C and stops workers by closing their connections
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker = TunnelShardWorker(connection, tunnel_client_class, address, port, max_packet_len, block_size, debug,
+                               publish_interval, idle_timeout, **kwargs)
+    asyncio.run(worker.run())
+
+
+class TunnelProxy:
+    """
+    Coordinator side stand-in for a tunnel that lives in a shard worker. Holds the state the worker last
+    published and forwards writes to the worker. Subclass this to give the state values names.
+    """
+
+    def __init__(self, factory, shard_index, key, address, **kwargs):
+        """
+        :param factory: TunnelShardedSocketFactory that owns the proxy
+        :param shard_index: index of the worker that owns the tunnel
+        :param key: the tunnel's key in its worker
+        :param address: the device's address
+        """
+        self.factory = factory
+        self.shard_index = shard_index
+        self.key = key
+        self.address = address
+        self.is_running = True
+        self.index = None  # the factory's TunnelIndex
+
+        self.state = ()  # values of the tunnel's get_shared_state
+        self.state_time = 0.0  # time.monotonic() when the state was received
+
+    def set_state(self, state: tuple, recv_time: float):
+        """Called when the worker publishes the tunnel's state"""
+        self.state = state
+        self.state_time = recv_time
+
+    def set_device_id(self, device_id, device_type):
+        """
+        Index this proxy in its factory under the ID and type the device reported. Devices that reconnect
+        to a different worker are evicted here
+        :return: the older proxy of the same device if it was evicted, otherwise None
+        """
+        if self.index is not None and self.is_running:
+            return self.index.update(self, device_id, device_type)
+        return None
+
+    def call(self, name: str, *args):
+        """Call a method of the tunnel in its worker. The return value is discarded"""
+        self.factory.send_command(self.shard_index, self.key, name, args)
+
+    def write(self, category: str, formats: str, *args):
+        self.call("write", category, formats, *args)
+
+    def write_many(self, messages):
+        self.call("write_many", list(messages))
+
+    def write_handshake(self, category: str, formats: str, *args):
+        self.call("write_handshake", category, formats, *args)
+
+    def close(self):
+        """Called when the tunnel in the worker stopped"""
+        if self.index is not None:
+            self.index.remove(self)
+        self.is_running = False
+
+    def stop(self):
+        self.call("stop")
+        self.close()
+
+
+class TunnelShardedSocketFactory:
+    """
+    TunnelSocketFactory that spreads device connections over num_shards worker processes. Each worker
+    listens on the same port with SO_REUSEPORT, so the kernel balances new connections between them, and
+    parses its connections with its own tunnel_client_class instances.
+
+    Workers publish the state of their tunnels (tunnel_client_class.get_shared_state packed with
+    tunnel_client_class.shared_state_format) to this process over a pipe. iter_tunnels yields a
+    tunnel_proxy_class instance for each connection so code that reads tunnel state and writes to tunnels
+    runs here unchanged. update doesn't return packet results since packets are handled in the workers.
+    """
+
+    def __init__(self, tunnel_client_class, tunnel_proxy_class, address, port, num_shards=None,
+                 max_packet_len=128, block_size=1024, debug=False, **kwargs):
+        """
+        :param tunnel_client_class: TunnelSocketServer subclass created in the workers
+        :param tunnel_proxy_class: TunnelProxy subclass created here
+        :param num_shards: number of worker processes. Defaults to the number of CPUs
+        :param kwargs: passed to tunnel_client_class in the workers and tunnel_proxy_class here
+        """
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise RuntimeError("SO_REUSEPORT is not supported on this platform")
+        self.address = address
+        self.port = port
+        self.block_size = block_size
+        self.max_packet_len = max_packet_len
+        self.debug = debug
+        self.tunnel_client_class = tunnel_client_class
+        self.tunnel_proxy_class = tunnel_proxy_class
+        self.client_class_kwargs = kwargs
+        self.num_shards = num_shards if num_shards is not None else os.cpu_count()
+        self.record_struct = get_shard_record_struct(tunnel_client_class)
+
+        # seconds between state messages from each worker
+        self.publish_interval = 0.25
+
+        # if not None, workers close tunnels idle for longer than this. See TunnelSocketFactory.idle_timeout
+        self.idle_timeout = None
+
+        self.processes = []
+        self.connections = []  # connection to each worker. None if the worker stopped
+
+        self.tunnels = []
+        self.proxies = {}  # {(shard_index, key): proxy}
+        self.index = TunnelIndex()  # proxies by the device ID and type they report
+
+        # set when a worker sends a message. Created in the event loop by wait
+        self.ready_event = None
+        self._loop = None
+
+        # longest time wait blocks if no worker sends anything
+        self.max_wait_time = 1.0
+
+    def start(self):
+        """Start the worker processes"""
+        for index in range(self.num_shards):
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=run_shard_worker,
+                args=(worker_connection, self.tunnel_client_class, self.address, self.port, self.max_packet_len,
+                      self.block_size, self.debug, self.publish_interval, self.idle_timeout,
+                      self.client_class_kwargs),
+                daemon=True
+            )
+            process.start()
+            worker_connection.close()
+            self.processes.append(process)
+            self.connections.append(connection)
+        if self.debug:
+            print("Started %s shards listening on %s:%s" % (self.num_shards, self.address, self.port))
+
+    def iter_tunnels(self):
+        for tunnel in self.tunnels:
+            yield tunnel
+
+    def get_tunnel(self, device_id):
+        """Return the proxy of a connected device by its ID or None if it isn't connected"""
+        return self.index.get(device_id)
+
+    def iter_tunnels_of_type(self, device_type):
+        """Iterate over the proxies of connected devices that reported a type"""
+        return self.index.iter_type(device_type)
+
+    def _start_readers(self):
+        self.ready_event = asyncio.Event()
+        self._loop = asyncio.get_event_loop()
+        for index, connection in enumerate(self.connections):
+            if connection is not None:
+                self._loop.add_reader(connection.fileno(), self._on_readable, index)
+
+    def _on_readable(self, index: int):
+        """Called by the event loop when a worker sent messages"""
+        self._receive(index)
+        self.ready_event.set()
+
+    def _receive(self, index: int):
+        """Apply all messages waiting on a worker's connection"""
+        connection = self.connections[index]
+        if connection is None:
+            return
+        try:
+            while connection.poll():
+                self._apply_message(index, connection.recv_bytes())
+        except (EOFError, OSError):
+            warnings.warn("Shard %s stopped" % index)
+            self._remove_shard(index)
+
+    def _apply_message(self, index: int, message: bytes):
+        kind = message[:1]
+        if kind == SHARD_STATE_MESSAGE:
+            recv_time = time.monotonic()
+            for values in self.record_struct.iter_unpack(message[1:]):
+                proxy = self.proxies.get((index, values[0]))
+                if proxy is not None:
+                    proxy.set_state(values[1:], recv_time)
+        elif kind == SHARD_OPEN_MESSAGE:
+            key, address = pickle.loads(message[1:])
+            proxy = self.tunnel_proxy_class(self, index, key, address, **self.client_class_kwargs)
+            proxy.index = self.index
+            self.proxies[(index, key)] = proxy
+            self.tunnels.append(proxy)
+        elif kind == SHARD_CLOSE_MESSAGE:
+            proxy = self.proxies.pop((index, pickle.loads(message[1:])), None)
+            if proxy is not None:
+                proxy.close()
+
+    def _remove_shard(self, index: int):
+        connection = self.connections[index]
+        if self._loop is not None:
+            self._loop.remove_reader(connection.fileno())
+        connection.close()
+        self.connections[index] = None
+        for key in [key for key in self.proxies if key[0] == index]:
+            self.proxies.pop(key).close()
+
+    def send_command(self, shard_index: int, key, name: str, args: tuple):
+        """
+        Call a tunnel method in a worker
+        :param key: the tunnel's key or None to call a method of the worker's factory
+        """
+        connection = self.connections[shard_index]
+        if connection is None:
+            return
+        try:
+            connection.send((key, name, args))
+        except OSError as e:
+            warnings.warn("Failed to write to shard %s: %s" % (shard_index, e))
+
+    async def wait(self):
+        """Wait until a worker publishes. Call this before update instead of sleeping"""
+        if self.ready_event is None:
+            self._start_readers()
+        if self.ready_event.is_set():
+            return
+        try:
+            await asyncio.wait_for(self.ready_event.wait(), self.max_wait_time)
+        except asyncio.TimeoutError:
+            pass
+
+    async def update(self):
+        if self.ready_event is not None:
+            self.ready_event.clear()
+        for index in range(len(self.connections)):
+            self._receive(index)
+        if not all([tunnel.is_running for tunnel in self.tunnels]):
+            self.tunnels = [tunnel for tunnel in self.tunnels if tunnel.is_running]
+        return []
+
+    def write(self, category, formats, *args):
+        for index in range(len(self.connections)):
+            self.send_command(index, None, "write", (category, formats) + args)
+
+    def write_many(self, messages):
+        """Write many packets to every tunnel. Each tunnel receives all of them in a single write"""
+        messages = list(messages)
+        for index in range(len(self.connections)):
+            self.send_command(index, None, "write_many", (messages,))
+
+    def stop(self):
+        # workers stop when their connection closes
+        for index, connection in enumerate(self.connections):
+            if connection is not None:
+                self._remove_shard(index)
+        for process in self.processes:
+            process.join(timeout=1.0)
+            if process.is_alive():
+                process.terminate()
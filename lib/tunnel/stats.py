@@ -0,0 +1,116 @@
+import time
+import warnings
+from collections import deque
+from .util import *
+
+
+class PacketErrorStats:
+    """
+    Counts packet errors by error code and keeps a bounded sample of recent bad packets.
+    Instead of warning for every malformed packet, a summary of the errors counted since the
+    last summary is warned at most once every summary_interval seconds. The first error after a quiet
+    interval is warned right away. Call warn_summary periodically so errors held back by the rate limit
+    are still warned if no more errors arrive.
+
+    Usage:
+    stats = PacketErrorStats(protocol.packet_error_codes)
+    stats.record(CHECKSUMS_DONT_MATCH_ERROR, packet)
+    stats.warn_summary()
+    """
+
+    def __init__(self, error_names: dict, max_samples=16, summary_interval=10.0):
+        """
+        :param error_names: dictionary of error code to printable string. Refer to TunnelProtocol.packet_error_codes
+        :param max_samples: number of recent bad packets to keep. Older samples are discarded
+        :param summary_interval: minimum time in seconds between summary warnings
+        """
+        self.error_names = error_names
+        self.summary_interval = summary_interval
+
+        self.counts = {}  # total number of errors for each error code
+        self.interval_counts = {}  # number of errors for each error code since the last summary
+
+        # (receive time, error code, packet bytes) of the most recent bad packets
+        self.samples = deque(maxlen=max_samples)
+
+        self.interval_start_time = time.monotonic()  # time interval_counts started counting
+        self.last_summary_time = None  # time of the most recent summary. None if no summary was warned
+
+    def record(self, error_code: int, packet=b"", recv_time=None):
+        """
+        Count an error and store the packet as a sample
+        :param error_code: int, error code of the packet. Refer to util
+        :param packet: bytes of the bad packet
+        :param recv_time: time the packet was received. Defaults to now
+        """
+        self.counts[error_code] = self.counts.get(error_code, 0) + 1
+        self.interval_counts[error_code] = self.interval_counts.get(error_code, 0) + 1
+        if recv_time is None:
+            recv_time = time.time()
+        self.samples.append((recv_time, error_code, packet))
+
+    def get_name(self, error_code: int) -> str:
+        """Interpret error_code into a readable string"""
+        if error_code in self.error_names:
+            return self.error_names[error_code]
+        else:
+            return "unknown error code %s" % error_code
+
+    def get_total(self) -> int:
+        """Total number of errors recorded"""
+        return sum(self.counts.values())
+
+    def get_summary(self, counts=None) -> str:
+        """
+        Format error counts into a single line
+        :param counts: dictionary of error code to count. Defaults to the total counts
+        :return: str, summary. Empty if there are no errors
+        """
+        if counts is None:
+            counts = self.counts
+        return ", ".join(["%s: %s" % (self.get_name(error_code), count) for error_code, count in counts.items()])
+
+    def warn_summary(self, force=False) -> bool:
+        """
+        Warn a summary of the errors counted since the last summary if summary_interval has passed
+        :param force: if True, warn regardless of the time since the last summary
+        :return: whether a summary was warned
+        """
+        if len(self.interval_counts) == 0:
+            return False
+        now = time.monotonic()
+        if not force and self.last_summary_time is not None and \
+                now - self.last_summary_time < self.summary_interval:
+            return False
+        duration = now - self.interval_start_time
+        message = "%s packet errors in the last %0.1fs: %s" % (
+            sum(self.interval_counts.values()), duration, self.get_summary(self.interval_counts))
+        if len(self.samples) > 0:
+            message += ". Most recent: %s" % repr(self.samples[-1][2])
+        warnings.warn(message)
+        self.interval_counts = {}
+        self.interval_start_time = now
+        self.last_summary_time = now
+        return True
+
+    def get_samples(self, error_code=None) -> list:
+        """
+        :param error_code: if not None, only return samples with this error code
+        :return: List[Tuple[float, int, bytes]] (receive time, error code, packet bytes) oldest first
+        """
+        if error_code is None:
+            return list(self.samples)
+        return [sample for sample in self.samples if sample[1] == error_code]
+
+    def reset(self):
+        """Clear all counts and samples"""
+        self.counts = {}
+        self.interval_counts = {}
+        self.samples.clear()
+        self.interval_start_time = time.monotonic()
+        self.last_summary_time = None
+
+    def __str__(self) -> str:
+        return "%s(%s)" % (self.__class__.__name__, self.get_summary())
+
+    __repr__ = __str__
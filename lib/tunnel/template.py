@@ -0,0 +1,37 @@
+from .util import *
+
+
+class PacketTemplate:
+    """
+    A packet encoded once to be written to many devices. Only the packet count and the checksum depend on
+    the receiving tunnel, so make_packet copies the encoded segments around a new count and checksum
+    instead of packing the arguments again.
+    """
+
+    def __init__(self, category: str, packet: bytes):
+        """
+        :param category: category of the packet
+        :param packet: complete packet created with a packet count of 0
+        """
+        self.category = category
+        count_start = PACKET_HEADER_LENGTH + PACKET_TYPE_LENGTH
+        count_stop = count_start + PACKET_COUNT_LENGTH
+        checksum_start = len(packet) - PACKET_CHECKSUM_LENGTH - len(PACKET_STOP)
+
+        self.prefix = bytes(packet[:count_start])  # start, length, and packet type bytes
+        self.body = bytes(packet[count_stop:checksum_start])  # category and data bytes
+
+        # checksum of the packet with a count of 0. The count's bytes are added for each packet
+        self.base_checksum = int(packet[checksum_start:checksum_start + PACKET_CHECKSUM_LENGTH], 16)
+
+    def __len__(self):
+        return len(self.prefix) + PACKET_COUNT_LENGTH + len(self.body) + PACKET_CHECKSUM_LENGTH + len(PACKET_STOP)
+
+    def make_packet(self, packet_num: int) -> bytes:
+        """
+        :param packet_num: packet count of the receiving tunnel
+        :return: bytes, the packet numbered packet_num
+        """
+        count = packet_num.to_bytes(PACKET_COUNT_LENGTH, "big")
+        checksum = (self.base_checksum + sum(count)) & 0xff
+        return b"".join((self.prefix, count, self.body, CHECKSUM_HEX_BYTES[checksum], PACKET_STOP))
@@ -15,6 +15,7 @@ PACKET_STOP_ERROR = 9
 SEGMENT_TOO_LONG_ERROR = 10
 PACKET_TIMEOUT_ERROR = 11
 PACKET_TYPE_NOT_FOUND_ERROR = 12
+CALLBACK_QUEUE_FULL_ERROR = 13
 
 PACKET_WARNINGS = [
     NO_ERROR,
@@ -27,6 +28,11 @@ PACKET_START_1 = b'\x13'
 PACKET_STOP = b'\n'
 PACKET_SEP = b'\t'
 PACKET_SEP_STR = '\t'
+PACKET_START = PACKET_START_0 + PACKET_START_1
+
+# checksums are encoded as two character hexadecimal strings. Index with the checksum value
+CHECKSUM_HEX_BYTES = [b"%02x" % value for value in range(0x100)]
+CHECKSUM_FOOTER_BYTES = [checksum + PACKET_STOP for checksum in CHECKSUM_HEX_BYTES]  # checksum and stop byte
 
 # Protocol fixed lengths
 PACKET_START_LENGTH = 1
@@ -37,6 +43,13 @@ PACKET_CHECKSUM_LENGTH = 2
 
 PACKET_HEADER_LENGTH = PACKET_START_LENGTH + PACKET_START_LENGTH + PACKET_LEN_LENGTH
 
+# packet type and packet count segments
+PACKET_HEADER_STRUCT = struct.Struct(">BI")
+
+# start bytes, length, packet type, and packet count segments. Packed in place once the data is written
+PACKET_PREFIX_STRUCT = struct.Struct(">2sHBI")
+PACKET_PREFIX_PLACEHOLDER = bytes(PACKET_PREFIX_STRUCT.size)
+
 # Packet types
 PACKET_TYPE_NORMAL = 0
 PACKET_TYPE_HANDSHAKE = 1
@@ -44,6 +57,9 @@ PACKET_TYPE_CONFIRMING = 2
 
 PACKET_TYPES = (PACKET_TYPE_NORMAL, PACKET_TYPE_HANDSHAKE, PACKET_TYPE_CONFIRMING)
 
+# confirming packets contain the handshake's packet number and the receiver's error code
+CONFIRMING_FORMATS = "ud"
+
 
 # Exception classes
 
@@ -9,8 +9,9 @@ from lib.logger_manager import LoggerManager
 from lib.session import Session
 from lib.config import Config
 
-from lib.tunnel.socket.server import TunnelSocketFactory
-from novacancy.tunnel_client import NoVacancyTunnelClient
+from lib.tunnel.socket.async_server import TunnelAsyncSocketFactory
+from lib.tunnel.socket.sharded_server import TunnelShardedSocketFactory
+from novacancy.tunnel_client import NoVacancyTunnelClient, NoVacancyTunnelProxy
 from novacancy.behaviors import Behaviors
 
 class MySession(Session):
@@ -27,11 +28,21 @@ class MySession(Session):
         self._load_config()  # pulls parameters from disk into config objects
         self.logger = self._init_log()  # initializes log object. Only call this once!!
 
-        self.tunnel_factory = TunnelSocketFactory(
-            NoVacancyTunnelClient, "0.0.0.0", 8080,
-            logger=self.logger,
-            config=self.config
-        )
+        if self.args.shards > 1:
+            # parse device connections in several processes. Behaviors runs here on the boards' published state
+            self.tunnel_factory = TunnelShardedSocketFactory(
+                NoVacancyTunnelClient, NoVacancyTunnelProxy, "0.0.0.0", 8080,
+                num_shards=self.args.shards,
+                logger=self.logger,
+                config=self.config
+            )
+        else:
+            self.tunnel_factory = TunnelAsyncSocketFactory(
+                NoVacancyTunnelClient, "0.0.0.0", 8080,
+                logger=self.logger,
+                config=self.config
+            )
+        self.tunnel_factory.idle_timeout = self.config.get_nested_default(("tunnel", "idle_timeout"), None)
         self.behaviors = Behaviors(self.logger, self.config, self.tunnel_factory)
 
     def start(self):
@@ -69,8 +80,8 @@ async def update_tunnel(session: MySession):
     """
     tunnel_factory = session.tunnel_factory
     while True:
+        await tunnel_factory.wait()  # sleeps until a board sends data or a handshake is due
         await tunnel_factory.update()
-        await asyncio.sleep(0.005)
 
 
 async def ping_tunnel(session: MySession):
@@ -88,9 +99,13 @@ def main():
     # parser.add_argument("--cli",
     #                     action="store_true",
     #                     help="If this flag is present, enable CLI")
+    parser.add_argument("--shards",
+                        type=int, default=1,
+                        help="Number of processes that handle device connections")
     cmd_args = parser.parse_args()
 
     args = RecursiveNamespace()
+    args.shards = cmd_args.shards
     # args.cli = cmd_args.cli
 
     session = MySession(args)
@@ -2,6 +2,7 @@ import time
 import asyncio
 import threading
 from novacancy.google_sheets import read_database, write_occupied_values, read_devices_config, read_groups_config
+from novacancy.tunnel_client import DeviceType
 from lib.recursive_namespace import RecursiveNamespace
 
 
@@ -49,17 +50,15 @@ class Behaviors:
                 board_ids = [str(row.id) for row in self.rows]
                 occupancies = [str(row.occupied) for row in self.rows]
 
-            for tunnel in self.tunnel_factory.iter_tunnels():
+            for tunnel in self.iter_occupancy_tunnels():
                 board_id = tunnel.get_board_id()
                 occupancy = tunnel.get_occupancy()
                 ip_address = tunnel.address[0]
 
+                # boards that stop sending data altogether are closed by the factory's idle_timeout
                 if tunnel.is_stale():
                     self.logger.info("Board ID %s (%s) is stale! Heartbeat stopped." % (board_id, ip_address))
                     continue
-            
-                if not tunnel.is_occupancy_device():
-                    continue
 
                 if board_id not in self.occupancy_states:
                     self.occupancy_states[board_id] = not occupancy
@@ -86,11 +85,14 @@ class Behaviors:
                 self.prev_occupancy_row = occupancies
             await asyncio.sleep(1.0)
 
+    def iter_occupancy_tunnels(self):
+        """Iterate over connected booth and door boards using the factory's type index"""
+        for board_type in DeviceType.get_occupancy_types():
+            for tunnel in self.tunnel_factory.iter_tunnels_of_type(board_type):
+                yield tunnel
+
     def get_tunnel(self, board_id):
-        for tunnel in self.tunnel_factory.iter_tunnels():
-            if board_id == tunnel.board_id:
-                return tunnel
-        return None
+        return self.tunnel_factory.get_tunnel(board_id)
 
     def get_group_name(self, board_id):
         for group_name, values in self.config.groups.items():
@@ -1,6 +1,7 @@
 import time
 import asyncio
 from lib.tunnel.socket.server import TunnelSocketServer
+from lib.tunnel.socket.sharded_server import TunnelProxy
 from lib.tunnel.result import PacketResult
 
 
@@ -15,53 +16,16 @@ class DeviceType:
         return cls.BOOTH, cls.DOOR
 
 
-class NoVacancyTunnelClient(TunnelSocketServer):
-    """Wrapper class for TunnelSocketServer adds functionality specific to the NoVacancy system"""
-
-    def __init__(self, socket_client, address, max_packet_len, block_size, debug, **kwargs):
-        super().__init__(socket_client, address, max_packet_len, block_size, debug)
-        self.logger = kwargs.get("logger")
-        self.config = kwargs.get("config")
-        self.start_time = time.monotonic()  # timer for ping
-        self.board_id = ""
-        self.board_type = -1
-        self.prev_heartbeat_remote = 0
-        self.prev_heartbeat_local = 0.0
-        self.heartbeat_interval = 1.0
+class NoVacancyBoard:
+    """
+    Occupancy and heartbeat logic shared by NoVacancyTunnelClient and NoVacancyTunnelProxy.
+    Subclasses set logger, config, board_id, board_type, weight, distance, latch, prev_heartbeat_local,
+    and heartbeat_interval, and implement write_handshake and set_device_id
+    """
 
-        self.weight = 0
-        self.distance = 0.0
-        self.latch = False
-
-    async def packet_callback(self, result: PacketResult):
-        """
-        Callback for when a new packet is received
-        :param result: PacketResult object containing data within the packet
-        :return: None
-        """
-        if result.category == "ping":
-            sent_time = result.get_double()
-            current_time = self.get_time()
-            ping = current_time - sent_time
-            self.logger.info("Ping %s: %0.5f (current: %0.5f, recv: %0.5f)" % (self.board_id, ping, current_time, sent_time))
-            await asyncio.sleep(0.0)
-        elif result.category == "heart":
-            board_id = str(result.get_int(4, signed=False))
-            self.board_type = result.get_int(4, signed=False)
-            self.prev_heartbeat_remote = result.get_int(4, signed=False)
-            self.prev_heartbeat_local = time.monotonic()
-            if self.board_id != board_id:
-                if self.board_id != -1:
-                    self.logger.warn("Board ID for client changed from %s to %s" % (self.board_id, board_id))
-                self.board_id = board_id
-                self.logger.info("Board ID for %s is %s" % (self.address, self.board_id))
-            self.board_id = board_id
-        elif result.category == "weight":
-            self.weight = result.get_int(4, signed=True)
-        elif result.category == "dist":
-            self.distance = result.get_float()
-        elif result.category == "latch":
-            self.latch = result.get_bool()
+    # time to wait before writing an unconfirmed command again. Backed off by the retransmit timer
+    # once confirm round trip times are measured
+    handshake_write_interval = 0.25
 
     def get_occupancy(self):
         """Return True if occupied, False if vacant"""
@@ -101,14 +65,23 @@ class NoVacancyTunnelClient(TunnelSocketServer):
 
     def set_bigsign(self, occupancy: bool):
         """True if occupied, False if vacant"""
-        self.write_handshake("bigsign", "c", occupancy)
+        self.write_handshake("bigsign", "c", occupancy, write_interval=self.handshake_write_interval)
 
     def set_led(self, pattern: str):
-        self.write_handshake("led", "s", pattern)
+        self.write_handshake("led", "s", pattern, write_interval=self.handshake_write_interval)
 
     def set_volume(self, volume: int):
         # lower numbers == louder volume!
-        self.write_handshake("volume", "c", volume)
+        self.write_handshake("volume", "c", volume, write_interval=self.handshake_write_interval)
+
+    def set_board_id(self, board_id: str, board_type: int):
+        """Called when a heartbeat reports a new ID or type. Updates the factory's index"""
+        self.board_id = board_id
+        self.board_type = board_type
+        evicted = self.set_device_id(board_id, board_type)
+        if evicted is not None:
+            self.logger.info("Board ID %s reconnected from %s. Closed its connection from %s" % (
+                board_id, self.address, evicted.address))
 
     def get_board_id(self):
         return self.board_id
@@ -119,6 +92,84 @@ class NoVacancyTunnelClient(TunnelSocketServer):
     def is_occupancy_device(self):
         return self.board_type in DeviceType.get_occupancy_types()
 
+
+class NoVacancyTunnelClient(NoVacancyBoard, TunnelSocketServer):
+    """Wrapper class for TunnelSocketServer adds functionality specific to the NoVacancy system"""
+
+    # state published by shard workers. See get_shared_state
+    shared_state_format = "?Iiif?d"
+
+    def __init__(self, socket_client, address, max_packet_len, block_size, debug, **kwargs):
+        super().__init__(socket_client, address, max_packet_len, block_size, debug)
+        self.logger = kwargs.get("logger")
+        self.config = kwargs.get("config")
+        self.start_time = time.monotonic()  # timer for ping
+        self.board_id = ""
+        self.board_type = -1
+        self.prev_heartbeat_remote = 0
+        self.prev_heartbeat_local = 0.0
+        self.heartbeat_interval = 1.0
+
+        self.weight = 0
+        self.distance = 0.0
+        self.latch = False
+
+        # decode the data segments of frequent packets in one call while parsing
+        self.protocol.register_schema("ping", "e", "sent_time")
+        self.protocol.register_schema("heart", "uuu", "board_id board_type uptime")
+        self.protocol.register_schema("weight", "d", "weight")
+        self.protocol.register_schema("dist", "f", "distance")
+
+        # ESP boards have small receive buffers. Back off handshake writes based on confirm times
+        # and don't let unconfirmed handshakes pile up on the link. Only the newest queued commands are kept
+        self.adaptive_retransmit = True
+        self.max_handshakes_in_flight = 4
+        self.max_queued_handshakes = 16
+
+    async def packet_callback(self, result: PacketResult):
+        """
+        Callback for when a new packet is received
+        :param result: PacketResult object containing data within the packet
+        :return: None
+        """
+        if result.category == "ping":
+            sent_time = result.get_values().sent_time
+            current_time = self.get_time()
+            ping = current_time - sent_time
+            self.logger.info("Ping %s: %0.5f (current: %0.5f, recv: %0.5f)" % (self.board_id, ping, current_time, sent_time))
+            await asyncio.sleep(0.0)
+        elif result.category == "heart":
+            heartbeat = result.get_values()
+            board_id = str(heartbeat.board_id)
+            self.prev_heartbeat_remote = heartbeat.uptime
+            self.prev_heartbeat_local = time.monotonic()
+            if self.board_id != board_id:
+                if self.board_id != -1:
+                    self.logger.warn("Board ID for client changed from %s to %s" % (self.board_id, board_id))
+                self.logger.info("Board ID for %s is %s" % (self.address, board_id))
+            if self.board_id != board_id or self.board_type != heartbeat.board_type:
+                self.set_board_id(board_id, heartbeat.board_type)
+        elif result.category == "weight":
+            self.weight = result.get_values().weight
+        elif result.category == "dist":
+            self.distance = result.get_values().distance
+        elif result.category == "latch":
+            self.latch = result.get_bool()
+
+    def get_shared_state(self):
+        """
+        State sent to the coordinator in sharded mode. Occupancy is computed by the coordinator
+        since it holds the up to date device config
+        :return: has board ID, board ID, board type, weight, distance, latch, seconds since the last heartbeat
+        """
+        has_board_id = len(self.board_id) > 0
+        board_id = int(self.board_id) if has_board_id else 0
+        return has_board_id, board_id, self.board_type, self.weight, self.distance, self.latch, self.get_heartbeat()
+
+    def get_idle_time(self):
+        """Seconds since the last heartbeat or since the board connected if it hasn't sent one"""
+        return min(self.get_heartbeat(), time.monotonic() - self.start_time)
+
     def get_time(self):
         """Get the time since __init__ was called"""
         return time.monotonic() - self.start_time
@@ -130,3 +181,47 @@ class NoVacancyTunnelClient(TunnelSocketServer):
     def stop(self):
         super().stop()
         self.logger.info("Client %s is stopping" % str(self.address))
+
+
+class NoVacancyTunnelProxy(NoVacancyBoard, TunnelProxy):
+    """Board state published by a NoVacancyTunnelClient in a shard worker. Used by TunnelShardedSocketFactory"""
+
+    def __init__(self, factory, shard_index, key, address, **kwargs):
+        super().__init__(factory, shard_index, key, address)
+        self.logger = kwargs.get("logger")
+        self.config = kwargs.get("config")
+        self.board_id = ""
+        self.board_type = -1
+        self.prev_heartbeat_local = 0.0
+        self.heartbeat_interval = 1.0
+
+        self.weight = 0
+        self.distance = 0.0
+        self.latch = False
+
+    def set_state(self, state: tuple, recv_time: float):
+        super().set_state(state, recv_time)
+        has_board_id, board_id, board_type, self.weight, self.distance, self.latch, heartbeat = state
+        board_id = str(board_id) if has_board_id else ""
+        if self.board_id != board_id:
+            self.logger.info("Board ID for %s is %s" % (self.address, board_id))
+        if has_board_id and (self.board_id != board_id or self.board_type != board_type):
+            self.set_board_id(board_id, board_type)
+        self.prev_heartbeat_local = recv_time - heartbeat
+
+    def write_ping(self):
+        self.call("write_ping")
+
+    # handshakes are written by the worker's NoVacancyTunnelClient with its write interval
+    def set_bigsign(self, occupancy: bool):
+        self.call("set_bigsign", occupancy)
+
+    def set_led(self, pattern: str):
+        self.call("set_led", pattern)
+
+    def set_volume(self, volume: int):
+        self.call("set_volume", volume)
+
+    def stop(self):
+        super().stop()
+        self.logger.info("Client %s is stopping" % str(self.address))
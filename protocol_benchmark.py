@@ -0,0 +1,362 @@
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import warnings
+
+from lib.tunnel.util import *
+from lib.tunnel.protocol import TunnelProtocol
+from lib.tunnel.decoder import TunnelDecoder
+from lib.tunnel.client import TunnelBaseClient
+
+# categories, formats, and example values of the packets the firmware sends
+FIRMWARE_MESSAGES = [
+    ("heart", "uuu", (12, 0, 123456)),
+    ("weight", "d", (-70000,)),
+    ("dist", "f", (120.5,)),
+    ("ping", "e", (12.345,)),
+]
+
+# schemas the server registers for the firmware's packets. Refer to NoVacancyTunnelClient
+FIRMWARE_SCHEMAS = [
+    ("ping", "e", "sent_time"),
+    ("heart", "uuu", "board_id board_type uptime"),
+    ("weight", "d", "weight"),
+    ("dist", "f", "distance"),
+]
+
+DEBUG_MESSAGES = [
+    b"Connected to server\n",
+    b"HX711 not found. Retrying\n",
+    b"Distance sensor timed out\n",
+]
+
+# name, fraction of packets that are corrupted, fraction of packets followed by a debug message, fragmented
+STREAM_VARIANTS = [
+    ("clean", 0.0, 0.0, False),
+    ("corrupted", 0.05, 0.0, False),
+    ("debug", 0.0, 0.1, False),
+    ("fragmented", 0.0, 0.0, True),
+    ("mixed", 0.05, 0.1, True),
+]
+
+
+def loop_checksum(packet):
+    """The original pure Python checksum. Kept here as a reference for comparison"""
+    calc_checksum = 0
+    for val in packet:
+        calc_checksum += val
+    calc_checksum &= 0xff
+    return calc_checksum
+
+
+def make_packet_bodies(protocol: TunnelProtocol):
+    """Checksummed segments (packet type, count, category, and data) of packets the firmware sends"""
+    packets = [protocol.make_packet(category, formats, *args) for category, formats, args in FIRMWARE_MESSAGES]
+    return [packet[PACKET_HEADER_LENGTH:-1 - PACKET_CHECKSUM_LENGTH] for packet in packets]
+
+
+def time_per_call(function, args_list, repeat):
+    """Return the mean time in seconds of calling function once with each argument in args_list"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for args in args_list:
+            function(args)
+    return (time.perf_counter() - start) / (repeat * len(args_list))
+
+
+def corrupt_packet(packet: bytes, rng: random.Random) -> bytes:
+    """Replace one byte after the length bytes with a random value so the checksum or stop byte fails"""
+    index = rng.randrange(PACKET_HEADER_LENGTH, len(packet))
+    value = (packet[index] + rng.randrange(1, 0x100)) & 0xff
+    return packet[:index] + bytes([value]) + packet[index + 1:]
+
+
+def make_stream(num_packets, corrupt_rate=0.0, debug_rate=0.0, seed=0) -> bytes:
+    """
+    Create bytes a board would send: firmware packets in order with consecutive packet numbers
+    :param num_packets: number of packets in the stream
+    :param corrupt_rate: fraction of packets that have a corrupted byte
+    :param debug_rate: fraction of packets followed by a debug message
+    :param seed: random seed. The same arguments always create the same stream
+    :return: bytes
+    """
+    rng = random.Random(seed)
+    protocol = TunnelProtocol()
+    stream = bytearray()
+    for index in range(num_packets):
+        category, formats, args = FIRMWARE_MESSAGES[index % len(FIRMWARE_MESSAGES)]
+        packet = protocol.make_packet(category, formats, *args)
+        if rng.random() < corrupt_rate:
+            packet = corrupt_packet(packet, rng)
+        stream += packet
+        if rng.random() < debug_rate:
+            stream += rng.choice(DEBUG_MESSAGES)
+    return bytes(stream)
+
+
+def fragment_stream(stream: bytes, max_chunk_len=64, seed=0) -> list:
+    """Split a stream into chunks of random lengths the way a socket might deliver it"""
+    rng = random.Random(seed)
+    chunks = []
+    index = 0
+    while index < len(stream):
+        length = rng.randint(1, max_chunk_len)
+        chunks.append(stream[index:index + length])
+        index += length
+    return chunks
+
+
+def chunk_stream(stream: bytes, chunk_len=1024) -> list:
+    """Split a stream into fixed size chunks the way TunnelSocketServer reads block_size bytes"""
+    return [stream[index:index + chunk_len] for index in range(0, len(stream), chunk_len)]
+
+
+class BenchmarkClient(TunnelBaseClient):
+    """TunnelBaseClient that reads from a list of chunks in memory and discards written packets"""
+
+    def __init__(self, chunks, max_packet_len=128):
+        super().__init__(max_packet_len)
+        self.chunks = chunks
+        self.chunk_index = 0
+        self.num_received = 0
+        for category, formats, names in FIRMWARE_SCHEMAS:
+            self.protocol.register_schema(category, formats, names)
+
+    def available(self):
+        if self.chunk_index >= len(self.chunks):
+            return 0
+        return len(self.chunks[self.chunk_index])
+
+    def _read(self, num_bytes):
+        chunk = self.chunks[self.chunk_index]
+        self.chunk_index += 1
+        return chunk
+
+    def _write(self, packet):
+        pass
+
+    def parse_debug_buffer(self, remaining_buffer):
+        pass
+
+    async def packet_callback(self, result):
+        result.get_values()
+        self.num_received += 1
+
+
+class Benchmark:
+    """Measures how many packets and bytes per second a function processes"""
+
+    def __init__(self, name: str, stream: str, num_packets: int, num_bytes: int, seconds: float, rounds: int):
+        self.name = name
+        self.stream = stream
+        self.num_packets = num_packets  # packets processed per round
+        self.num_bytes = num_bytes  # bytes processed per round
+        self.seconds = seconds  # total time of all rounds
+        self.rounds = rounds
+
+    def get_packets_per_second(self) -> float:
+        return self.num_packets * self.rounds / self.seconds
+
+    def get_bytes_per_second(self) -> float:
+        return self.num_bytes * self.rounds / self.seconds
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "stream": self.stream,
+            "packets": self.num_packets,
+            "bytes": self.num_bytes,
+            "rounds": self.rounds,
+            "seconds": self.seconds,
+            "packets_per_second": self.get_packets_per_second(),
+            "bytes_per_second": self.get_bytes_per_second(),
+        }
+
+    def __str__(self) -> str:
+        return "%-14s %-11s %12.0f packets/s %10.2f MB/s" % (
+            self.name, self.stream, self.get_packets_per_second(), self.get_bytes_per_second() / 1E6)
+
+
+def run_rounds(function, rounds) -> float:
+    """Call function once per round and return the total time in seconds"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function()
+    return time.perf_counter() - start
+
+
+def bench_make_packet(num_packets, rounds) -> list:
+    protocol = TunnelProtocol()
+    messages = [FIRMWARE_MESSAGES[index % len(FIRMWARE_MESSAGES)] for index in range(num_packets)]
+    num_bytes = sum([len(protocol.make_packet(category, formats, *args)) for category, formats, args in messages])
+
+    def make_packets():
+        for category, formats, args in messages:
+            protocol.make_packet(category, formats, *args)
+
+    buffer = bytearray()
+
+    def make_packets_into():
+        del buffer[:]
+        protocol.make_packets_into(buffer, messages)
+
+    return [
+        Benchmark("make_packet", "clean", num_packets, num_bytes, run_rounds(make_packets, rounds), rounds),
+        Benchmark("make_packet", "into", num_packets, num_bytes, run_rounds(make_packets_into, rounds), rounds),
+    ]
+
+
+def bench_parse_packet(num_packets, rounds) -> list:
+    protocol = TunnelProtocol()
+    for category, formats, names in FIRMWARE_SCHEMAS:
+        protocol.register_schema(category, formats, names)
+    writer = TunnelProtocol()
+    packets = [writer.make_packet(category, formats, *args) for category, formats, args in FIRMWARE_MESSAGES]
+    packets = [packets[index % len(packets)] for index in range(num_packets)]
+    num_bytes = sum(map(len, packets))
+
+    def parse_packets():
+        for packet in packets:
+            protocol.parse_packet(packet)
+
+    return [Benchmark("parse_packet", "clean", num_packets, num_bytes, run_rounds(parse_packets, rounds), rounds)]
+
+
+def bench_parse_buffer(streams, rounds) -> list:
+    benchmarks = []
+    for name, num_packets, stream, chunks in streams:
+        def parse_buffer():
+            # parse the way clients did before TunnelDecoder: unparsed bytes are prepended to the next chunk
+            protocol = TunnelProtocol()
+            buffer = b""
+            for chunk in chunks:
+                buffer += chunk
+                _, buffer, _ = protocol.parse_buffer(buffer)
+
+        seconds = run_rounds(parse_buffer, rounds)
+        benchmarks.append(Benchmark("parse_buffer", name, num_packets, len(stream), seconds, rounds))
+    return benchmarks
+
+
+def bench_decoder(streams, rounds) -> list:
+    benchmarks = []
+    for name, num_packets, stream, chunks in streams:
+        def feed():
+            decoder = TunnelDecoder(TunnelProtocol())
+            for chunk in chunks:
+                decoder.feed(chunk)
+
+        seconds = run_rounds(feed, rounds)
+        benchmarks.append(Benchmark("decoder", name, num_packets, len(stream), seconds, rounds))
+    return benchmarks
+
+
+def bench_update(streams, rounds) -> list:
+    benchmarks = []
+    loop = asyncio.new_event_loop()
+    for name, num_packets, stream, chunks in streams:
+        async def update():
+            client = BenchmarkClient(chunks)
+            while client.chunk_index < len(client.chunks):
+                await client.update()
+
+        seconds = run_rounds(lambda: loop.run_until_complete(update()), rounds)
+        benchmarks.append(Benchmark("update", name, num_packets, len(stream), seconds, rounds))
+    loop.close()
+    return benchmarks
+
+
+def bench_checksum(repeat):
+    protocol = TunnelProtocol()
+    bodies = make_packet_bodies(protocol)
+    views = [memoryview(body) for body in bodies]
+    for body in bodies:
+        assert protocol.calculate_checksum(body) == loop_checksum(body)
+    assert protocol.calculate_checksums(bodies) == [loop_checksum(body) for body in bodies]
+
+    loop_time = time_per_call(loop_checksum, bodies, repeat)
+    sum_time = time_per_call(protocol.calculate_checksum, bodies, repeat)
+    view_time = time_per_call(protocol.calculate_checksum, views, repeat)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        protocol.calculate_checksums(bodies)
+    batch_time = (time.perf_counter() - start) / (repeat * len(bodies))
+
+    print("Checksum per packet (mean body length: %0.1f bytes)" % (sum(map(len, bodies)) / len(bodies)))
+    print("\tloop:\t\t%0.3f us" % (loop_time * 1E6))
+    print("\tsum:\t\t%0.3f us (%0.1fx)" % (sum_time * 1E6, loop_time / sum_time))
+    print("\tmemoryview:\t%0.3f us (%0.1fx)" % (view_time * 1E6, loop_time / view_time))
+    print("\tbatch:\t\t%0.3f us (%0.1fx)" % (batch_time * 1E6, loop_time / batch_time))
+
+
+def make_streams(num_packets, seed) -> list:
+    """
+    :return: List[Tuple[str, int, bytes, List[bytes]]] name, number of packets, stream bytes,
+        and the chunks the stream is delivered in for each of STREAM_VARIANTS
+    """
+    streams = []
+    for name, corrupt_rate, debug_rate, fragmented in STREAM_VARIANTS:
+        stream = make_stream(num_packets, corrupt_rate, debug_rate, seed)
+        if fragmented:
+            chunks = fragment_stream(stream, seed=seed)
+        else:
+            chunks = chunk_stream(stream)
+        streams.append((name, num_packets, stream, chunks))
+    return streams
+
+
+def main():
+    benchmark_names = ["checksum", "make_packet", "parse_packet", "parse_buffer", "decoder", "update"]
+    parser = argparse.ArgumentParser(description="TunnelProtocol benchmarks")
+    parser.add_argument("--repeat", type=int, default=100000, help="Number of times to repeat each checksum measurement")
+    parser.add_argument("--packets", type=int, default=2000, help="Number of packets in each generated stream")
+    parser.add_argument("--rounds", type=int, default=20, help="Number of times each stream is processed")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for corrupting and fragmenting streams")
+    parser.add_argument("--only", nargs="+", choices=benchmark_names, default=benchmark_names,
+                        help="Benchmarks to run")
+    parser.add_argument("--output", default="", help="Save throughput results to this JSON file")
+    args = parser.parse_args()
+
+    # corrupted streams are expected to produce packet errors. Don't let their summaries clutter the results
+    warnings.simplefilter("ignore")
+
+    if "checksum" in args.only:
+        bench_checksum(args.repeat)
+
+    streams = make_streams(args.packets, args.seed)
+    benchmarks = []
+    if "make_packet" in args.only:
+        benchmarks.extend(bench_make_packet(args.packets, args.rounds))
+    if "parse_packet" in args.only:
+        benchmarks.extend(bench_parse_packet(args.packets, args.rounds))
+    if "parse_buffer" in args.only:
+        benchmarks.extend(bench_parse_buffer(streams, args.rounds))
+    if "decoder" in args.only:
+        benchmarks.extend(bench_decoder(streams, args.rounds))
+    if "update" in args.only:
+        benchmarks.extend(bench_update(streams, args.rounds))
+
+    for benchmark in benchmarks:
+        print(benchmark)
+
+    if args.output:
+        report = {
+            "time": time.time(),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "packets": args.packets,
+            "rounds": args.rounds,
+            "seed": args.seed,
+            "results": [benchmark.to_dict() for benchmark in benchmarks],
+        }
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+        print("Saved results to %s" % args.output)
+
+
+main()
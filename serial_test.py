@@ -0,0 +1,62 @@
+import time
+import asyncio
+import threading
+
+from lib.tunnel.protocol import TunnelProtocol
+from lib.tunnel.serial.client import TunnelSerialClient
+from lib.tunnel.serial.pty_device import PtySerialDevice
+
+
+class MyClient(TunnelSerialClient):
+    def __init__(self, address, baud):
+        super().__init__(address, baud, debug=False)
+        self.num_pings = 0
+
+    async def packet_callback(self, result):
+        if result.category == "ping":
+            self.num_pings += 1
+            self.write("ping", "e", result.get_double())
+
+
+def simulate_device(device: PtySerialDevice, num_pings, stop_event):
+    """Write pings like a board would and count the replies"""
+    protocol = TunnelProtocol()
+    buffer = b""
+    num_replies = 0
+    for count in range(num_pings):
+        device.write(protocol.make_packet("ping", "e", time.monotonic()))
+        buffer += device.read(0.01)
+    while not stop_event.is_set() and num_replies < num_pings:
+        buffer += device.read(0.1)
+        remaining_buffer, buffer, results = protocol.parse_buffer(buffer)
+        num_replies += len(results)
+    print("Device received %s of %s replies" % (num_replies, num_pings))
+
+
+async def run(tunnel, duration):
+    start_time = time.monotonic()
+    while time.monotonic() - start_time < duration:
+        await tunnel.wait()  # doesn't block the event loop while the serial port is quiet
+        await tunnel.update()
+
+
+def main():
+    device = PtySerialDevice()
+    tunnel = MyClient(device.port, 115200)
+    tunnel.start()
+
+    stop_event = threading.Event()
+    device_thread = threading.Thread(target=simulate_device, args=(device, 100, stop_event))
+    device_thread.start()
+    try:
+        asyncio.run(run(tunnel, 2.0))
+    finally:
+        stop_event.set()
+        device_thread.join()
+        tunnel.stop()
+        device.close()
+    print("Client received %s pings" % tunnel.num_pings)
+
+
+if __name__ == "__main__":
+    main()
@@ -94,6 +94,7 @@ def main():
                 print("Num packets recv: ", tunnel.protocol.read_packet_num)
                 print("Duration: %0.4fs" % duration)
                 print("Dropped packets: ", tunnel.protocol.dropped_packet_num)
+                print("Packet errors: ", tunnel.protocol.error_stats.get_summary())
 
 
 main()
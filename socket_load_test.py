@@ -0,0 +1,182 @@
+import os
+import time
+import errno
+import socket
+import asyncio
+import argparse
+import resource
+import multiprocessing
+
+from lib.tunnel.protocol import TunnelProtocol
+from lib.tunnel.socket.server import TunnelSocketFactory, TunnelSocketServer
+from lib.tunnel.socket.async_server import TunnelAsyncSocketFactory
+from lib.tunnel.socket.selector_server import TunnelSelectorSocketFactory
+
+BACKENDS = {
+    "thread": TunnelSocketFactory,
+    "asyncio": TunnelAsyncSocketFactory,
+    "selector": TunnelSelectorSocketFactory,
+}
+
+
+class LoadTestClient(TunnelSocketServer):
+    """Counts heartbeats received from simulated devices"""
+    num_received = 0
+
+    def __init__(self, socket_client, address, max_packet_len, block_size, debug, **kwargs):
+        super().__init__(socket_client, address, max_packet_len, block_size, debug)
+        self.protocol.register_schema("heart", "uuu", "board_id board_type uptime")
+
+    async def packet_callback(self, result):
+        result.get_values()
+        LoadTestClient.num_received += 1
+
+
+def raise_file_limit():
+    """Allow as many open sockets as the system does"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def simulate_devices(address, port, rate, num_connections, num_sent, stop_event):
+    """
+    Open num_connections.value connections and send each one a heartbeat rate times per second.
+    Runs in a separate process so it doesn't share the server's CPU time. Packets that can't be sent
+    right away are dropped, so a server that falls behind receives less than expected
+    """
+    raise_file_limit()
+    devices = []
+    interval = 1.0 / rate
+    next_round = time.monotonic()
+    while not stop_event.is_set():
+        # connect without blocking so devices that are connected keep sending while the server accepts new ones
+        while len(devices) < num_connections.value:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            error = sock.connect_ex((address, port))
+            if error not in (0, errno.EINPROGRESS):
+                print("Failed to connect device %s: %s" % (len(devices), os.strerror(error)))
+                sock.close()
+                break
+            devices.append((sock, TunnelProtocol()))
+
+        start_time = time.monotonic()
+        round_sent = 0
+        for board_id, (sock, protocol) in enumerate(devices):
+            uptime = int((time.monotonic() - start_time) * 1000)
+            packet = protocol.make_packet("heart", "uuu", board_id, 0, uptime)
+            try:
+                sock.send(packet)  # packets are small. Assume they're sent whole or not at all
+                round_sent += 1
+            except OSError:
+                pass  # not connected yet or the server isn't keeping up. The packet is lost
+        num_sent.value += round_sent
+
+        next_round += interval
+        delay = next_round - time.monotonic()
+        if delay > 0.0:
+            time.sleep(delay)
+        else:
+            next_round = time.monotonic()  # can't keep up. Don't try to catch up
+    for sock, protocol in devices:
+        sock.close()
+
+
+async def run_server(factory, duration):
+    """Run the factory for duration seconds"""
+    start_time = time.monotonic()
+    while time.monotonic() - start_time < duration:
+        await factory.wait()
+        await factory.update()
+
+
+def measure(loop, factory, num_connections, num_sent, duration, settle_time) -> dict:
+    """Run the server with a number of connected devices and measure its CPU usage and packet rate"""
+    # let devices connect and the first packets arrive
+    loop.run_until_complete(run_server(factory, settle_time))
+    connected = len(factory.tunnels)
+
+    LoadTestClient.num_received = 0
+    start_sent = num_sent.value
+    start_cpu = time.process_time()
+    start_time = time.monotonic()
+    loop.run_until_complete(run_server(factory, duration))
+    wall_time = time.monotonic() - start_time
+    cpu_time = time.process_time() - start_cpu
+
+    # packets in flight at the start and end of the window make this slightly inexact
+    expected = num_sent.value - start_sent
+    return {
+        "connections": num_connections,
+        "connected": connected,
+        "cpu": cpu_time / wall_time,
+        "packets_per_second": LoadTestClient.num_received / wall_time,
+        "sent_per_second": expected / wall_time,
+        "received_ratio": LoadTestClient.num_received / expected if expected > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find how many device connections a TunnelSocketFactory backend sustains at a CPU budget")
+    parser.add_argument("--backend", choices=list(BACKENDS.keys()), default="selector", help="Server I/O backend")
+    parser.add_argument("--address", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8090, help="Port to listen on")
+    parser.add_argument("--start", type=int, default=100, help="Number of connections in the first step")
+    parser.add_argument("--step", type=int, default=100, help="Connections added each step")
+    parser.add_argument("--max-connections", type=int, default=5000, help="Stop after this many connections")
+    parser.add_argument("--rate", type=float, default=1.0, help="Heartbeats per second sent by each device")
+    parser.add_argument("--cpu-budget", type=float, default=0.5,
+                        help="Fraction of one core the server may use (includes the I/O thread)")
+    parser.add_argument("--min-received", type=float, default=0.95,
+                        help="Fraction of sent heartbeats the server must process")
+    parser.add_argument("--duration", type=float, default=5.0, help="Measurement time per step in seconds")
+    parser.add_argument("--settle", type=float, default=2.0, help="Time for devices to connect before measuring")
+    args = parser.parse_args()
+
+    file_limit = raise_file_limit()
+    if args.max_connections * 2 + 16 > file_limit:
+        print("Warning: open file limit (%s) may be too low for %s connections" % (file_limit, args.max_connections))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    factory = BACKENDS[args.backend](LoadTestClient, args.address, args.port)
+    factory.start()
+
+    num_connections = multiprocessing.Value("i", 0)
+    num_sent = multiprocessing.Value("q", 0)
+    stop_event = multiprocessing.Event()
+    simulator = multiprocessing.Process(
+        target=simulate_devices, args=(args.address, args.port, args.rate, num_connections, num_sent, stop_event))
+    simulator.start()
+
+    print("backend: %s, rate: %s packets/s per device, cpu budget: %0.0f%%" % (
+        args.backend, args.rate, args.cpu_budget * 100))
+    print("%12s %10s %8s %12s %12s %9s" % ("connections", "connected", "cpu", "sent/s", "received/s", "received"))
+    sustained = 0
+    try:
+        count = args.start
+        while count <= args.max_connections:
+            num_connections.value = count
+            result = measure(loop, factory, count, num_sent, args.duration, args.settle)
+            print("%12s %10s %7.1f%% %12.1f %12.1f %8.1f%%" % (
+                result["connections"], result["connected"], result["cpu"] * 100, result["sent_per_second"],
+                result["packets_per_second"], result["received_ratio"] * 100))
+            if result["cpu"] > args.cpu_budget or result["received_ratio"] < args.min_received or \
+                    result["connected"] < count:
+                break
+            sustained = count
+            count += args.step
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        simulator.join()
+        factory.stop()
+        loop.close()
+    print("%s backend sustained %s connections at %0.0f%% CPU" % (args.backend, sustained, args.cpu_budget * 100))
+
+
+if __name__ == "__main__":
+    main()